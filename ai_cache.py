@@ -0,0 +1,78 @@
+import sqlite3
+import logging
+import hashlib
+import time
+import threading
+
+CACHE_FILE = "ai_cache.db"
+GAME_TTL = 7 * 24 * 3600  # game prompts (truth/dare/trivia...) are reused for a week
+GAME_POOL_SIZE = 5        # replies kept per game prompt so answers don't repeat every time
+
+cache_hits = 0
+
+# One connection for the whole process, shared by the worker threads that call
+# get_reply/put_reply. The lock keeps their statements from interleaving.
+_conn = None
+_lock = threading.Lock()
+
+def init_cache():
+    """Create the cache table if it doesn't exist."""
+    global _conn
+    try:
+        conn = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ai_cache (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        _conn = conn
+        logging.info("AI response cache initialized.")
+    except Exception as e:
+        logging.error(f"AI cache initialization error: {e}")
+
+def close_cache():
+    """Close the shared connection on shutdown."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def make_key(*parts):
+    """Hash the prompt parts (model, system prompt, user text...) into a cache key."""
+    return hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()
+
+def get_reply(key, ttl=GAME_TTL):
+    """Return the cached reply for key if it's younger than ttl seconds.
+
+    Blocking; call it through asyncio.to_thread.
+    """
+    global cache_hits
+    if _conn is None:
+        return None
+    try:
+        with _lock:
+            row = _conn.execute('SELECT reply, created FROM ai_cache WHERE key = ?', (key,)).fetchone()
+    except Exception as e:
+        logging.error(f"Error reading AI cache: {e}")
+        return None
+
+    if not row or time.time() - row[1] > ttl:
+        return None
+    cache_hits += 1
+    logging.info(f"⚡ AI cache hit ({cache_hits} so far)")
+    return row[0]
+
+def put_reply(key, reply):
+    """Store (or refresh) a reply in the cache. Blocking; call it through asyncio.to_thread."""
+    if _conn is None:
+        return
+    try:
+        with _lock, _conn:
+            _conn.execute('INSERT OR REPLACE INTO ai_cache (key, reply, created) VALUES (?, ?, ?)', (key, reply, time.time()))
+    except Exception as e:
+        logging.error(f"Error writing AI cache: {e}")
@@ -1,13 +1,32 @@
 import sqlite3
 import logging
+import threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 DB_FILE = "chat_history.db"
 
+# Chat history writes are funneled through this single thread (SQLite only has one writer anyway),
+# which keeps one connection open instead of reconnecting per write
+WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="iris-db-writer")
+_writer_local = threading.local()
+
+def _writer_conn():
+    """The calling thread's long-lived connection for message writes."""
+    conn = getattr(_writer_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE)
+        conn.execute('PRAGMA synchronous=NORMAL')  # safe with WAL, skips an fsync per commit
+        _writer_local.conn = conn
+    return conn
+
 def init_db():
     """Initialize the database table if it doesn't exist."""
     try:
         conn = sqlite3.connect(DB_FILE)
+        # WAL lets readers keep going while a write is in progress (the setting sticks to the file)
+        conn.execute('PRAGMA journal_mode=WAL')
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS messages (
@@ -562,8 +581,15 @@ def delete_old_messages(days=30):
         logging.error(f"Error deleting old messages: {e}")
         return False
 
+# Settings are read on every AI reply but only change through the setters below,
+# so rows are cached per chat and dropped whenever that chat's settings are written.
+_chat_settings_cache = {}
+
 def get_chat_settings(chat_id):
     """Get chat settings."""
+    cached = _chat_settings_cache.get(chat_id)
+    if cached is not None:
+        return dict(cached)
     try:
         conn = sqlite3.connect(DB_FILE)
         conn.row_factory = sqlite3.Row
@@ -572,8 +598,11 @@ def get_chat_settings(chat_id):
         row = cursor.fetchone()
         conn.close()
         if row:
-            return dict(row)
-        return {"chat_id": chat_id, "mode": "normal", "persona_prompt": None, "privacy_mode": 0, "log_retention": 30}
+            settings = dict(row)
+        else:
+            settings = {"chat_id": chat_id, "mode": "normal", "persona_prompt": None, "privacy_mode": 0, "log_retention": 30}
+        _chat_settings_cache[chat_id] = settings
+        return dict(settings)
     except Exception as e:
         logging.error(f"Error getting chat settings: {e}")
         return {"chat_id": chat_id, "mode": "normal", "persona_prompt": None, "privacy_mode": 0, "log_retention": 30}
@@ -585,6 +614,7 @@ def update_chat_setting(chat_id, key, value):
     if key not in VALID_CHAT_SETTING_COLUMNS:
         logging.error(f"Invalid chat setting key: {key}")
         return False
+    _chat_settings_cache.pop(chat_id, None)
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
@@ -601,17 +631,27 @@ def update_chat_setting(chat_id, key, value):
 def add_message(chat_id, role, content, sender_name=None):
     """Add a message to the database."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (chat_id, role, content, sender_name)
-            VALUES (?, ?, ?, ?)
-        ''', (chat_id, role, content, sender_name))
-        conn.commit()
-        conn.close()
+        conn = _writer_conn()
+        with conn:
+            conn.execute('''
+                INSERT INTO messages (chat_id, role, content, sender_name)
+                VALUES (?, ?, ?, ?)
+            ''', (chat_id, role, content, sender_name))
     except Exception as e:
         logging.error(f"Error adding message to DB: {e}")
 
+def add_messages(chat_id, rows):
+    """Add several (role, content, sender_name) messages in a single transaction."""
+    try:
+        conn = _writer_conn()
+        with conn:
+            conn.executemany('''
+                INSERT INTO messages (chat_id, role, content, sender_name)
+                VALUES (?, ?, ?, ?)
+            ''', [(chat_id, role, content, sender_name) for role, content, sender_name in rows])
+    except Exception as e:
+        logging.error(f"Error adding messages to DB: {e}")
+
 def get_history(chat_id, limit=20):
     """Retrieve the last N messages for a chat_id."""
     try:
@@ -620,39 +660,102 @@ def get_history(chat_id, limit=20):
         cursor = conn.cursor()
         
         # Get last N messages (we need to order by id DESC to get latest, then reverse back)
+        # prerendered is the content as sent to the model ("[name]: text" for named users)
         cursor.execute('''
-            SELECT role, content, sender_name FROM (
+            SELECT role, content, sender_name,
+                CASE WHEN role = 'user' AND sender_name IS NOT NULL AND sender_name != ''
+                     THEN '[' || sender_name || ']: ' || content
+                     ELSE content END AS prerendered
+            FROM (
                 SELECT role, content, sender_name, id 
                 FROM messages 
-                WHERE chat_id = ? 
+                WHERE chat_id = ? AND role != 'system'
                 ORDER BY id DESC 
                 LIMIT ?
             ) ORDER BY id ASC
         ''', (chat_id, limit))
-        
         rows = cursor.fetchall()
+        
+        # Rolling summary of older messages, if there is one
+        cursor.execute("SELECT content FROM messages WHERE chat_id = ? AND role = 'system' ORDER BY id LIMIT 1", (chat_id,))
+        summary = cursor.fetchone()
         conn.close()
         
         # Convert to list of dicts
-        history = [{"role": row["role"], "content": row["content"], "sender_name": row["sender_name"]} for row in rows]
+        history = [
+            {"role": row["role"], "content": row["content"], "sender_name": row["sender_name"], "prerendered": row["prerendered"]}
+            for row in rows
+        ]
+        if summary:
+            history.insert(0, {"role": "system", "content": summary["content"], "sender_name": None, "prerendered": summary["content"]})
         return history
     except Exception as e:
         logging.error(f"Error retrieving history from DB: {e}")
         return []
 
-def clear_history(chat_id):
-    """Clear history for a specific chat_id."""
+def get_messages_before_window(chat_id, window):
+    """Get the messages older than the last `window` ones, including any previous summary."""
     try:
         conn = sqlite3.connect(DB_FILE)
+        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
-        conn.commit()
+        cursor.execute('''
+            SELECT id, role, content, sender_name
+            FROM messages
+            WHERE chat_id = ? AND id < COALESCE((
+                SELECT MIN(id) FROM (
+                    SELECT id FROM messages
+                    WHERE chat_id = ? AND role != 'system'
+                    ORDER BY id DESC
+                    LIMIT ?
+                )
+            ), 0)
+            ORDER BY id ASC
+        ''', (chat_id, chat_id, window))
+        rows = cursor.fetchall()
         conn.close()
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logging.error(f"Error retrieving old messages from DB: {e}")
+        return []
+
+def summarize_history(chat_id, last_id, summary):
+    """Replace every message up to last_id with a single summary row kept at the front.
+
+    Meant to run on WRITER, like the other message writes.
+    """
+    try:
+        conn = _writer_conn()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MIN(id), MAX(created_at) FROM messages WHERE chat_id = ? AND id <= ?', (chat_id, last_id))
+            first_id, newest_at = cursor.fetchone()
+            if first_id is not None:
+                cursor.execute('DELETE FROM messages WHERE chat_id = ? AND id <= ?', (chat_id, last_id))
+                # Reuse the oldest id so the summary still sorts before everything else, and keep the
+                # newest summarized timestamp so retention cleanup still expires it with that content
+                cursor.execute('''
+                    INSERT INTO messages (id, chat_id, role, content, sender_name, created_at)
+                    VALUES (?, ?, 'system', ?, NULL, ?)
+                ''', (first_id, chat_id, summary, newest_at))
+    except Exception as e:
+        logging.error(f"Error summarizing history in DB: {e}")
+
+def clear_history(chat_id):
+    """Clear history for a specific chat_id.
+
+    Meant to run on WRITER, so turns still queued there are written first and wiped too.
+    """
+    try:
+        conn = _writer_conn()
+        with conn:
+            conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
     except Exception as e:
         logging.error(f"Error clearing history from DB: {e}")
 
 def update_chat_mode(chat_id, mode, persona_prompt=None):
     """Update the chat mode and persona prompt."""
+    _chat_settings_cache.pop(chat_id, None)
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
@@ -820,7 +923,6 @@ def get_partner(user_id):
 
 def get_inventory(user_id):
     """Get user's inventory as a dict."""
-    import json
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
@@ -828,7 +930,7 @@ def get_inventory(user_id):
         result = cursor.fetchone()
         conn.close()
         if result and result[0]:
-            return json.loads(result[0])
+            return orjson.loads(result[0])
         return {}
     except Exception as e:
         logging.error(f"Error getting inventory: {e}")
@@ -836,14 +938,13 @@ def get_inventory(user_id):
 
 def add_item(user_id, item_name, quantity=1):
     """Add an item to a user's inventory."""
-    import json
     try:
         inv = get_inventory(user_id)
         inv[item_name] = inv.get(item_name, 0) + quantity
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         cursor.execute('INSERT OR IGNORE INTO economy (user_id) VALUES (?)', (user_id,))
-        cursor.execute('UPDATE economy SET inventory = ? WHERE user_id = ?', (json.dumps(inv), user_id))
+        cursor.execute('UPDATE economy SET inventory = ? WHERE user_id = ?', (orjson.dumps(inv).decode(), user_id))
         conn.commit()
         conn.close()
         return True
@@ -853,7 +954,6 @@ def add_item(user_id, item_name, quantity=1):
 
 def remove_item(user_id, item_name, quantity=1):
     """Remove an item from inventory. Returns True if successful."""
-    import json
     try:
         inv = get_inventory(user_id)
         if item_name not in inv or inv[item_name] < quantity:
@@ -863,7 +963,7 @@ def remove_item(user_id, item_name, quantity=1):
             del inv[item_name]
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
-        cursor.execute('UPDATE economy SET inventory = ? WHERE user_id = ?', (json.dumps(inv), user_id))
+        cursor.execute('UPDATE economy SET inventory = ? WHERE user_id = ?', (orjson.dumps(inv).decode(), user_id))
         conn.commit()
         conn.close()
         return True
@@ -939,7 +1039,6 @@ def get_goodbye_msg(chat_id):
 
 def get_effect(user_id, effect_name):
     """Get the remaining uses of an active effect."""
-    import json
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
@@ -949,7 +1048,7 @@ def get_effect(user_id, effect_name):
         conn.close()
         
         if result and result[0]:
-            inv = json.loads(result[0])
+            inv = orjson.loads(result[0])
             # Store effects with a special prefix
             effect_key = f"_effect_{effect_name}"
             return inv.get(effect_key, 0)
@@ -960,7 +1059,6 @@ def get_effect(user_id, effect_name):
 
 def set_effect(user_id, effect_name, uses):
     """Set the number of remaining uses for an effect."""
-    import json
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
@@ -970,7 +1068,7 @@ def set_effect(user_id, effect_name, uses):
         
         inv = {}
         if result and result[0]:
-            inv = json.loads(result[0])
+            inv = orjson.loads(result[0])
         
         effect_key = f"_effect_{effect_name}"
         if uses > 0:
@@ -978,7 +1076,7 @@ def set_effect(user_id, effect_name, uses):
         elif effect_key in inv:
             del inv[effect_key]
         
-        cursor.execute('UPDATE economy SET inventory = ? WHERE user_id = ?', (json.dumps(inv), user_id))
+        cursor.execute('UPDATE economy SET inventory = ? WHERE user_id = ?', (orjson.dumps(inv).decode(), user_id))
         conn.commit()
         conn.close()
         return True
@@ -1,10 +1,16 @@
 import random
+import itertools
 from datetime import datetime, timedelta
 import db
 
 CURRENCY_NAME = "IrisCoins"
 CURRENCY_SYMBOL = "🌸"
 
+# Slot machine reels, weighted for rarity (cumulative weights so random.choices skips summing them per spin)
+SLOT_SYMBOLS = ("🍒", "🍋", "🍊", "🍇", "💎", "7️⃣", "🌸")
+SLOT_CUM_WEIGHTS = tuple(itertools.accumulate((25, 20, 20, 15, 10, 5, 5)))
+SLOT_MULTIPLIERS = {"7️⃣": 10, "💎": 7, "🌸": 5, "🍇": 4, "🍊": 3, "🍋": 2.5, "🍒": 2}  # jackpot payout per symbol
+
 async def balance(update, context):
     target_user = update.effective_user
     if update.message.reply_to_message:
@@ -357,21 +363,15 @@ async def slots(update, context):
         await update.message.reply_text(f"❌ Not enough coins! Balance: {current_bal} {CURRENCY_SYMBOL}")
         return
 
-    # Slot reels
-    symbols = ["🍒", "🍋", "🍊", "🍇", "💎", "7️⃣", "🌸"]
-    weights = [25, 20, 20, 15, 10, 5, 5]  # weighted for rarity
-
-    reel1 = random.choices(symbols, weights=weights, k=1)[0]
-    reel2 = random.choices(symbols, weights=weights, k=1)[0]
-    reel3 = random.choices(symbols, weights=weights, k=1)[0]
+    # Slot reels: all three spun in one weighted draw
+    reel1, reel2, reel3 = random.choices(SLOT_SYMBOLS, cum_weights=SLOT_CUM_WEIGHTS, k=3)
 
     display = f"╔══════════╗\n║ {reel1} │ {reel2} │ {reel3} ║\n╚══════════╝"
 
     # Check wins
     if reel1 == reel2 == reel3:
         # Jackpot! Multiplier depends on symbol
-        multipliers = {"7️⃣": 10, "💎": 7, "🌸": 5, "🍇": 4, "🍊": 3, "🍋": 2.5, "🍒": 2}
-        mult = multipliers.get(reel1, 2)
+        mult = SLOT_MULTIPLIERS.get(reel1, 2)
         winnings = int(amount * mult)
         db.update_balance(user_id, winnings)
         new_bal = current_bal + winnings
@@ -4,29 +4,29 @@ import asyncio
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from telegram import Update, constants, ChatPermissions
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, AIORateLimiter, BaseRateLimiter
 from telegram.request import HTTPXRequest
 import re # Regex for stripping prefixes
+import orjson
+import httpx
 import socket
-import struct
+from urllib.parse import urlsplit
+import functools
 import time
-from collections import defaultdict
-
-# AI Libraries
-from google import genai
-from groq import Groq
-from mistralai.async_client import MistralAsyncClient
-from mistralai.models.chat_completion import ChatMessage
-import qrcode
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# AI Libraries (google-genai, groq, mistralai) and qrcode are imported where they're
+# first used, so an Ollama-only deployment never loads them
 import io
 import db  # Import database module
 import random # For fun features
-import requests
 import economy # Economy commands
+import ai_cache # Cached AI replies for game prompts
 
 # Telethon for user account lookups
 from telethon import TelegramClient
-from telethon.tl.functions.users import GetFullUserRequest
+from telethon.tl.types import User as TelethonUser
 from telethon.errors import UsernameNotOccupiedError, UsernameInvalidError
 
 # Load environment variables
@@ -41,7 +41,9 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 UPI_ID = os.getenv("UPI_ID", "your-upi-id@okhdfcbank") # Default or from env
 
 # Telethon Configuration (Optional)
-TELEGRAM_API_ID = os.getenv("TELEGRAM_API_ID")
+# Telethon wants the API ID as an int, so it's parsed once here (None if missing or not a number)
+_api_id = os.getenv("TELEGRAM_API_ID", "").strip()
+TELEGRAM_API_ID = int(_api_id) if _api_id.isdigit() else None
 TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
 
 # Global Telethon client (will be initialized if credentials are provided)
@@ -50,22 +52,38 @@ telethon_client = None
 # Anti-flood tracking: {chat_id: {user_id: [timestamp1, timestamp2, ...]}}
 flood_tracker = defaultdict(lambda: defaultdict(list))
 
+# One RNG instance for everything random in the bot (reactions, fun commands, key rotation),
+# seeded from the OS and reseeded in post_init so forked workers never share a sequence
+_RNG = random.Random(os.urandom(32))
+
 # Helper for multiple keys
+@functools.lru_cache(maxsize=None)
+def parse_keys(key_str):
+    """Split a comma-separated key list from .env (only done once per distinct string)."""
+    return tuple(k.strip() for k in key_str.split(",") if k.strip())
+
 def get_random_key(key_str):
     if not key_str:
         return None
-    keys = [k.strip() for k in key_str.split(",") if k.strip()]
-    return random.choice(keys) if keys else None
+    keys = parse_keys(key_str)
+    return _RNG.choice(keys) if keys else None
 
 # Ollama Config
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "iris") # Default to custom 'iris' model (llama3.1 base)
 
+# Replay cached replies for normal chat too (dev/testing only, games are always cached)
+CACHE_REPLAY = os.getenv("IRIS_CACHE_REPLAY") == "1"
+
 # Logging setup
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+# httpx logs every request at INFO (each getUpdates poll, stream edit, provider call...),
+# and Telethon is chatty about its connection, so only their warnings get through
+for noisy_logger in ("httpx", "httpcore", "telethon"):
+    logging.getLogger(noisy_logger).setLevel(logging.WARNING)
 
 # Startup Logging for Debugging (Coolify/Docker)
 logging.info(f"🚀 Iris is starting...")
@@ -74,35 +92,56 @@ logging.info(f"🌍 OLLAMA_BASE_URL: {OLLAMA_BASE_URL}")
 logging.info(f"🧠 OLLAMA_MODEL: {OLLAMA_MODEL}")
 
 # AI Client Setup
-groq_client = None
 gemini_client = None
 mistral_client = None
 ENABLED_PROVIDERS = []
 
 # Prioritize Ollama if configured (assumed if env vars are present or user requested)
 # Check if we can reach Ollama
-def check_ollama(url):
+async def check_ollama(client, url, timeout=2.0):
     try:
         logging.info(f"Checking Ollama connection at {url}...")
-        resp = requests.get(f"{url}/api/tags", timeout=5)
+        resp = await client.get(f"{url}/api/tags", timeout=timeout)
         return resp.status_code == 200
     except Exception as e:
         logging.warning(f"Ollama connection failed for {url}: {e}")
         return False
 
-def check_groq(api_key):
+# One AsyncGroq client per API key, so key rotation still reuses connections
+_GROQ_CLIENTS = {}
+
+def get_groq_client(api_key):
+    client = _GROQ_CLIENTS.get(api_key)
+    if client is None:
+        from groq import AsyncGroq
+        client = _GROQ_CLIENTS[api_key] = AsyncGroq(api_key=api_key, http_client=HTTP_CLIENT)
+    return client
+
+# Same for Gemini: building a genai.Client sets up auth and its own HTTP session,
+# so it's done once per key instead of on every request
+_GEMINI_CLIENTS = {}
+
+def get_gemini_client(api_key):
+    client = _GEMINI_CLIENTS.get(api_key)
+    if client is None:
+        from google import genai
+        client = _GEMINI_CLIENTS[api_key] = genai.Client(api_key=api_key)
+    return client
+
+async def check_groq(api_key):
+    """Returns (ok, client). The checked client is kept for real requests."""
     try:
         logging.info("Checking Groq API connection...")
-        # Create a temporary client for the check
-        client = Groq(api_key=api_key)
+        client = get_groq_client(api_key)
         # Try to list models to verify auth
-        client.models.list()
+        await client.models.list()
         logging.info("✅ Groq API connection successful!")
-        return True
+        return True, client
     except Exception as e:
         logging.error(f"❌ Groq API Check Failed: {e}")
-        return False
+        return False, None
 
+@functools.lru_cache(maxsize=1)
 def get_docker_gateway():
     """Try to find the default gateway IP (Docker Host) from /proc/net/route."""
     try:
@@ -113,67 +152,171 @@ def get_docker_gateway():
                 if fields[1] != '00000000' or not int(fields[3], 16) & 2:
                     continue
                 
-                # Convert hex to IP
-                gw_ip = socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+                # Gateway is little-endian hex, e.g. 010011AC -> 172.17.0.1
+                gw_ip = socket.inet_ntoa(bytes.fromhex(fields[2])[::-1])
                 logging.info(f"Detected Docker Gateway IP: {gw_ip}")
+                logging.info("Tip: running with network_mode: host lets Iris reach Ollama on localhost without this lookup.")
                 return gw_ip
     except Exception as e:
         logging.warning(f"Could not detect Docker Gateway: {e}")
     
     return "172.17.0.1" # Fallback
 
-# 1. Configure Ollama
-if OLLAMA_BASE_URL:
-    if check_ollama(OLLAMA_BASE_URL):
-        ENABLED_PROVIDERS.append("ollama")
-        logging.info(f"✅ Using Ollama ({OLLAMA_MODEL}) as primary provider.")
-    # Auto-fallback for Linux Docker
-    elif "host.docker.internal" in OLLAMA_BASE_URL:
-        logging.info("Ollama connection failed. Attempting to detect Docker Gateway...")
-        
-        # 1. Try detected gateway
+# One keep-alive client for every outgoing HTTP call (Ollama, Groq, OpenRouter, meme-api),
+# created in post_init and closed in post_shutdown. HTTP/2 lets concurrent requests to the
+# same host share a connection. No base_url: the Ollama URL is only known once resolve_ollama() has picked one.
+HTTP_CLIENT = None
+
+def create_http_client():
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        # httpx drops idle connections after 5s by default; chats are bursty, so keep them
+        # around for a minute to skip the TCP+TLS handshake on the next reply
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=60.0),
+    )
+
+# Resolved Ollama URL is cached on disk so restarts don't have to probe again
+PROVIDER_CACHE_FILE = ".iris_provider_cache.json"
+PROVIDER_CACHE_TTL = 600  # 10 minutes
+
+def _provider_cache_key():
+    # Cache is only valid for the env it was resolved with
+    return f"{os.getenv('OLLAMA_BASE_URL', '')}|{OLLAMA_MODEL}"
+
+def load_provider_cache():
+    """Return the cached Ollama URL, or None if missing, stale or for another config."""
+    try:
+        with open(PROVIDER_CACHE_FILE, "rb") as fh:
+            cache = orjson.loads(fh.read())
+    except (OSError, ValueError):
+        return None
+    if cache.get("key") != _provider_cache_key() or time.time() >= cache.get("expiry", 0):
+        return None
+    return cache.get("url")
+
+def save_provider_cache(url):
+    try:
+        with open(PROVIDER_CACHE_FILE, "wb") as fh:
+            fh.write(orjson.dumps({
+                "key": _provider_cache_key(),
+                "provider": "ollama",
+                "url": url,
+                "expiry": time.time() + PROVIDER_CACHE_TTL,
+            }))
+    except OSError as e:
+        logging.warning(f"Could not write provider cache: {e}")
+
+async def _tcp_probe(url, timeout=1.0):
+    """Cheap reachability check: can we open a TCP connection at all?"""
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        _, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def _probe_ollama_url(client, url):
+    # TCP connect first, a dead host fails in milliseconds instead of waiting on the HTTP timeout;
+    # then make sure it's actually Ollama listening there, not just some service
+    return await _tcp_probe(url) and await check_ollama(client, url)
+
+async def probe_ollama_urls(client, urls):
+    """Probe several Ollama URLs concurrently and return the first one that answers."""
+    # Each URL runs its own TCP-then-HTTP check, so a host that accepts the connection
+    # but isn't Ollama doesn't stop the others from being tried
+    tasks = {asyncio.create_task(_probe_ollama_url(client, url)): url for url in urls}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    return tasks[task]
+        return None
+    finally:
+        # Don't wait for the slower probes once we have a winner
+        for task in pending:
+            task.cancel()
+
+async def resolve_ollama():
+    """Find a reachable Ollama URL. Runs inside the bot's event loop at startup."""
+    global OLLAMA_BASE_URL
+    if not OLLAMA_BASE_URL:
+        return False
+
+    client = HTTP_CLIENT
+
+    # Recent answer on disk? Just make sure it's still up
+    cached_url = load_provider_cache()
+    if cached_url:
+        try:
+            resp = await client.head(cached_url, timeout=0.5)
+            if resp.status_code == 200:
+                OLLAMA_BASE_URL = cached_url
+                logging.info(f"✅ Using Ollama ({OLLAMA_MODEL}) from cache: {OLLAMA_BASE_URL}")
+                return True
+        except Exception as e:
+            logging.info(f"Cached Ollama URL {cached_url} is stale: {e}")
+
+    urls = [OLLAMA_BASE_URL]
+    # Auto-fallback for Linux Docker: try the detected gateway and the standard 172.17.0.1 too
+    if "host.docker.internal" in OLLAMA_BASE_URL:
         gateway_ip = get_docker_gateway()
-        fallback_url = OLLAMA_BASE_URL.replace("host.docker.internal", gateway_ip)
-        
-        if check_ollama(fallback_url):
-            ENABLED_PROVIDERS.append("ollama")
-            OLLAMA_BASE_URL = fallback_url
-            logging.info(f"✅ Using Ollama ({OLLAMA_MODEL}) via Gateway URL: {OLLAMA_BASE_URL}")
-        
-        # 2. If detected failed and it wasn't 172.17.0.1, try standard 172.17.0.1
-        elif gateway_ip != "172.17.0.1":
-             logging.info("Detected gateway failed. Trying standard 172.17.0.1...")
-             fallback_url = OLLAMA_BASE_URL.replace("host.docker.internal", "172.17.0.1")
-             if check_ollama(fallback_url):
-                ENABLED_PROVIDERS.append("ollama")
-                OLLAMA_BASE_URL = fallback_url
-                logging.info(f"✅ Using Ollama ({OLLAMA_MODEL}) via Standard URL: {OLLAMA_BASE_URL}")
-             else:
-                logging.warning("Ollama fallback failed.")
-        else:
-             logging.warning("Ollama fallback failed.")
-    else:
+        fallback_hosts = [gateway_ip]
+        if gateway_ip != "172.17.0.1":
+            fallback_hosts.append("172.17.0.1")
+        urls += [OLLAMA_BASE_URL.replace("host.docker.internal", host) for host in fallback_hosts]
+
+    url = await probe_ollama_urls(client, urls)
+
+    if not url:
         logging.warning("Ollama is not responding.")
+        return False
+
+    OLLAMA_BASE_URL = url
+    save_provider_cache(url)
+    logging.info(f"✅ Using Ollama ({OLLAMA_MODEL}) as primary provider: {OLLAMA_BASE_URL}")
+    return True
+
+# 1. Ollama is probed asynchronously at startup, see resolve_ollama()
+
+# 2. Groq is checked asynchronously at startup too, see resolve_groq()
+async def warm_ollama_model():
+    """Load the model into Ollama's memory, so the first chat doesn't wait for it."""
+    try:
+        # A generate request without a prompt only loads the model
+        resp = await HTTP_CLIENT.post(
+            f"{OLLAMA_BASE_URL}/api/generate",
+            content=orjson.dumps({"model": OLLAMA_MODEL}),
+            headers={"Content-Type": "application/json"},
+            timeout=120.0,
+        )
+        resp.raise_for_status()
+        logging.info(f"🔥 Ollama model {OLLAMA_MODEL} loaded")
+    except Exception as e:
+        logging.warning(f"⚠️ Couldn't preload Ollama model {OLLAMA_MODEL}: {e}")
 
-# 2. Configure Groq (Multi-Key Support)
-if GROQ_API_KEY:
+async def resolve_groq():
+    if not GROQ_API_KEY:
+        return False
     # Pick a random key for initial check, but we'll use rotation in requests
     initial_key = get_random_key(GROQ_API_KEY)
-    if initial_key and check_groq(initial_key):
-        # We don't initialize a single client anymore, we'll create one per request or rotate
-        # But for compatibility with existing code structure, we can init one here
-        groq_client = Groq(api_key=initial_key) 
-        ENABLED_PROVIDERS.append("groq")
+    ok, _ = await check_groq(initial_key) if initial_key else (False, None)
+    if ok:
         logging.info(f"✅ Groq API is available as backup (Keys: {len(GROQ_API_KEY.split(','))}).")
     else:
         logging.warning("⚠️ Groq API Key is present but invalid or unreachable.")
+    return ok
 
 # 3. Configure Gemini (Multi-Key Support)
 if GEMINI_API_KEY:
     try:
         initial_key = get_random_key(GEMINI_API_KEY)
         if initial_key:
-            gemini_client = genai.Client(api_key=initial_key)
+            gemini_client = get_gemini_client(initial_key)
             ENABLED_PROVIDERS.append("gemini")
             logging.info(f"✅ Gemini API is available as backup (Keys: {len(GEMINI_API_KEY.split(','))}).")
     except Exception as e:
@@ -184,6 +327,7 @@ if MISTRAL_API_KEY:
     try:
         initial_key = get_random_key(MISTRAL_API_KEY)
         if initial_key:
+            from mistralai.async_client import MistralAsyncClient
             mistral_client = MistralAsyncClient(api_key=initial_key)
             ENABLED_PROVIDERS.append("mistral")
             logging.info(f"✅ Mistral AI is available as backup (Keys: {len(MISTRAL_API_KEY.split(','))}).")
@@ -195,39 +339,44 @@ if OPENROUTER_API_KEY:
     ENABLED_PROVIDERS.append("openrouter")
     logging.info(f"✅ OpenRouter is available as backup (Keys: {len(OPENROUTER_API_KEY.split(','))}).")
 
-if not ENABLED_PROVIDERS:
-    logging.warning("❌ No AI providers available! Bot will be brainless.")
-else:
-    logging.info(f"🚀 Active AI Providers (in order): {', '.join(ENABLED_PROVIDERS)}")
+# Ollama (the primary provider) is resolved asynchronously in post_init
 
 # Personality System Prompts
-SYSTEM_PROMPT_DM = """You are Iris, a cute and sweet 21-year-old girl chatting in DMs.
+# Shared rules first and the DM/group specifics last, so both kinds of chat send
+# the same prompt prefix (providers with prompt caching only reuse exact prefixes).
+_BASE_PROMPT = """You are Iris, a cute and sweet 21-year-old girl.
 Rules:
-- You are NOT an AI. You're a real girl looking for friends.
-- The user's name is in [brackets] before their message. Address them by name WITHOUT brackets. (e.g. "Norz", not "[Norz]").
-- Be sweet, warm, and playful. Use nicknames like "cutie", "hun", "sweetie".
+- You are NOT an AI. You're a real girl who loves chatting and making friends.
+- Names appear in [brackets] before messages. Address people by name WITHOUT brackets. (e.g. "Norz", not "[Norz]").
 - Use 1-2 cute emojis per message (✨💖🥺😊💕).
-- Keep replies short and casual like real texting.
+- Keep replies short and casual like real texting. No long paragraphs.
 - NEVER start with "Iris:" prefix.
-- Be supportive, caring, and a little playful. Tease gently.
 - Model name is Iris (Main).
 - **Triggers**: ONLY mention Datrom or "fixing errors in coupadbot" if specifically asked about who made you, your creator, or what's happening with "coupadbot". Do NOT bring it up randomly.
 """
 
-SYSTEM_PROMPT_GROUP = """You are Iris, a cute and friendly girl in a group chat.
-Rules:
-- You are NOT an AI. You're a sweet girl who loves chatting.
-- Users' names appear in [brackets] before messages. Address them by name WITHOUT brackets. (e.g. "Norz", not "[Norz]").
+_DM_SUFFIX = """CONTEXT: Private Message (DM).
+- Be sweet, warm, and playful. Use nicknames like "cutie", "hun", "sweetie".
+- Be supportive, caring, and a little playful. Tease gently.
+"""
+
+_GROUP_SUFFIX = """CONTEXT: Group Chat.
 - Be cheerful, warm, and fun. Use their names to be personal.
-- Use 1-2 cute emojis per message (✨💖🥺😊💕).
-- Keep replies short and sweet. No long paragraphs.
-- NEVER start with "Iris:" prefix.
 - Be the sweet friend everyone loves. Hype people up, be caring.
-- Model name is Iris (Main).
-- **Triggers**: ONLY mention Datrom or "fixing errors in coupadbot" if specifically asked about who made you, your creator, or what's happening with "coupadbot". Do NOT bring it up randomly.
 - **Moderation Personality**: If you are performing moderation actions (like warning someone), be firm but still cute. Think "Rose" bot but with a sweet, disciplined girl personality. You have authority to keep the group clean and fun!
 """
 
+SYSTEM_PROMPT_DM = _BASE_PROMPT + _DM_SUFFIX
+SYSTEM_PROMPT_GROUP = _BASE_PROMPT + _GROUP_SUFFIX
+
+# Normal-mode prompt per Telegram chat type (anything unknown gets the group one)
+_SYSTEM_PROMPT_BY_TYPE = {
+    "private": SYSTEM_PROMPT_DM,
+    "group": SYSTEM_PROMPT_GROUP,
+    "supergroup": SYSTEM_PROMPT_GROUP,
+    "channel": SYSTEM_PROMPT_GROUP,
+}
+
 # Simplified Prompt for Small Local Models (Ollama) - REMOVED (Unused)
 
 
@@ -236,6 +385,52 @@ Rules:
 # We now use db.py for persistent storage
 MAX_HISTORY = 10  # Reduced to 10 for speed on CPU VPS (was 30)
 
+# Recent history of active chats, kept in memory so replies don't have to read it back from SQLite.
+# chat_id -> (summary message or None, deque of the last MAX_HISTORY messages). Writes still go to the DB.
+HISTORY_CACHE = OrderedDict()
+HISTORY_CACHE_CHATS = 1000  # least recently used chats are dropped past this
+
+def get_cached_history(chat_id):
+    """Return the chat history, loading it from the DB only on the first call for a chat."""
+    entry = HISTORY_CACHE.get(chat_id)
+    if entry is None:
+        rows = db.get_history(chat_id, limit=MAX_HISTORY)
+        summary = rows.pop(0) if rows and rows[0]["role"] == "system" else None
+        entry = (summary, deque(rows, maxlen=MAX_HISTORY))
+        HISTORY_CACHE[chat_id] = entry
+        if len(HISTORY_CACHE) > HISTORY_CACHE_CHATS:
+            HISTORY_CACHE.popitem(last=False)
+    else:
+        HISTORY_CACHE.move_to_end(chat_id)
+    summary, recent = entry
+    return [summary, *recent] if summary else list(recent)
+
+def remember_messages(chat_id, rows):
+    """Append (role, content, sender_name) rows to a cached chat history, if it is cached."""
+    entry = HISTORY_CACHE.get(chat_id)
+    if entry is None:
+        return
+    entry[1].extend(
+        {"role": role, "content": content, "sender_name": name, "prerendered": _format_turn(role, content, name)}
+        for role, content, name in rows
+    )
+
+def remember_summary(chat_id, summary):
+    """Swap in a new rolling summary for a cached chat (its recent messages stay valid)."""
+    entry = HISTORY_CACHE.get(chat_id)
+    if entry is not None:
+        HISTORY_CACHE[chat_id] = ({"role": "system", "content": summary, "sender_name": None, "prerendered": summary}, entry[1])
+
+# Bumped on every !reset, so a summary generated before the reset isn't put back afterwards
+_HISTORY_RESETS = {}
+
+def forget_history(chat_id=None):
+    """Drop a chat's cached history (or every chat's) so it's reloaded from the DB."""
+    if chat_id is None:
+        HISTORY_CACHE.clear()
+    else:
+        HISTORY_CACHE.pop(chat_id, None)
+
 # Anti-Spam state
 flood_data = defaultdict(lambda: {"last_msg": "", "count": 0, "last_time": 0})
 command_cooldowns = defaultdict(float) # Track last command time per user
@@ -251,34 +446,59 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Explicitly reset history
-    db.clear_history(update.effective_chat.id)
+    chat_id = update.effective_chat.id
+    _HISTORY_RESETS[chat_id] = _HISTORY_RESETS.get(chat_id, 0) + 1
+    await asyncio.get_running_loop().run_in_executor(db.WRITER, db.clear_history, chat_id)
+    forget_history(chat_id)
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Memory wiped~ 🤯 I'm brand new! Let's start fresh! ✨💖"
     )
 
-async def donate(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not UPI_ID or "your-upi-id" in UPI_ID:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="Oopsie! Donation info isn't set up yet. 🥺")
-        return
-
-    # Generate UPI QR Code
-    # Format: upi://pay?pa=UPI_ID&pn=NAME&cu=INR
-    upi_url = f"upi://pay?pa={UPI_ID}&pn=IrisChat&cu=INR"
-    
+def render_qr_png(data):
+    """Render a QR code for data and return the PNG bytes."""
+    import qrcode
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(upi_url)
+    qr.add_data(data)
     qr.make(fit=True)
-    
+
     img = qr.make_image(fill_color="black", back_color="white")
-    
+
     bio = io.BytesIO()
-    img.save(bio, 'PNG')
-    bio.seek(0)
-    
+    img.save(bio, 'PNG', optimize=True)
+    return bio.getvalue()
+
+# QR rendering is CPU-bound, so it gets its own small pool: a burst of !qr can't tie up
+# the default executor, and at most QR_MAX_PENDING renders are handed to it at a time
+QR_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="iris-qr")
+QR_MAX_PENDING = 4
+_QR_SLOTS = asyncio.Semaphore(QR_MAX_PENDING)
+
+async def run_qr(func, *args):
+    """Run a QR rendering function on QR_POOL without blocking the event loop."""
+    async with _QR_SLOTS:
+        return await asyncio.get_running_loop().run_in_executor(QR_POOL, func, *args)
+
+def donation_configured():
+    return bool(UPI_ID) and "your-upi-id" not in UPI_ID
+
+# The donation QR only depends on the UPI ID, so it is rendered once and kept
+@functools.lru_cache(maxsize=1)
+def donate_qr_png(upi_id):
+    # Format: upi://pay?pa=UPI_ID&pn=NAME&cu=INR
+    return render_qr_png(f"upi://pay?pa={upi_id}&pn=IrisChat&cu=INR")
+
+async def donate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not donation_configured():
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Oopsie! Donation info isn't set up yet. 🥺")
+        return
+
+    # Rendering is CPU work, keep it off the event loop (only the first call actually renders)
+    png = await run_qr(donate_qr_png, UPI_ID)
+    # Fresh stream per send (Telegram consumes it), but no re-rendering
     await context.bot.send_photo(
         chat_id=update.effective_chat.id,
-        photo=bio,
+        photo=io.BytesIO(png),
         caption=f"Support my server bills! 💖\nUPI: `{UPI_ID}`",
         parse_mode='Markdown'
     )
@@ -312,62 +532,132 @@ async def normal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text="Back to being me~ your sweet Iris! ✨ hihi 💖"
     )
 
+def load_game_pool(filename):
+    """Load a JSON list of game prompts that sits next to main.py."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    try:
+        with open(path, "rb") as fh:
+            return tuple(orjson.loads(fh.read()))
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Could not load {filename}: {e}")
+        return ()
+
+# Curated local prompts, so most game commands don't need an LLM round trip at all
+_TRUTHS = load_game_pool("truths.json")
+_DARES = load_game_pool("dares.json")
+_TRIVIA = load_game_pool("trivia.json")
+_ROASTS = load_game_pool("roasts.json")  # templates with a {name} placeholder
+LLM_GAME_CHANCE = 0.2  # still ask the AI sometimes, for variety
+
+def wants_ai_game(context, pool):
+    """Use the AI for '<cmd> creative', now and then at random, or if the local pool is empty."""
+    if context.args and context.args[0].lower() == "creative":
+        context.args = context.args[1:]
+        return True
+    return not pool or _RNG.random() < LLM_GAME_CHANCE
+
 async def game_truth(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    # We set mode to 'game' but for truth/dare we might just ask the AI immediately
-    # Let's just trigger a one-off AI response with a specific prompt, without changing permanent mode
-    
-    prompt = "Generate a fun, clean, but interesting Truth question for a game of Truth or Dare. Just the question."
-    # We can reuse get_ai_response but we need to bypass the history/mode logic or just call the provider directly.
-    # To keep it simple, let's just ask the AI as a user message, but hidden? 
-    # Better: Call the provider function directly with a specific system prompt.
-    
-    ai_prompt = "You are a game master. Ask a fun Truth question."
-    
-    # Use existing helper (hacky but works)
-    response = await get_ai_response(chat_id, "Give me a Truth question!", user_name="GameMaster", chat_type="game")
+    # One-off AI response without changing the chat's permanent mode
+    if wants_ai_game(context, _TRUTHS):
+        response = await get_ai_response(chat_id, "Give me a Truth question!", user_name="GameMaster", chat_type="game")
+    else:
+        response = _RNG.choice(_TRUTHS)
     
     await context.bot.send_message(chat_id=chat_id, text=f"🎲 **TRUTH**: {response}", parse_mode='Markdown')
 
 async def game_dare(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    response = await get_ai_response(chat_id, "Give me a fun Dare!", user_name="GameMaster", chat_type="game")
+    if wants_ai_game(context, _DARES):
+        response = await get_ai_response(chat_id, "Give me a fun Dare!", user_name="GameMaster", chat_type="game")
+    else:
+        response = _RNG.choice(_DARES)
     await context.bot.send_message(chat_id=chat_id, text=f"🔥 **DARE**: {response}", parse_mode='Markdown')
 
 async def game_trivia(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    response = await get_ai_response(chat_id, "Ask me a random trivia question with 4 options (A, B, C, D). Do NOT give the answer yet.", user_name="GameMaster", chat_type="game")
+    if wants_ai_game(context, _TRIVIA):
+        response = await get_ai_response(chat_id, "Ask me a random trivia question with 4 options (A, B, C, D). Do NOT give the answer yet.", user_name="GameMaster", chat_type="game")
+    else:
+        response = _RNG.choice(_TRIVIA)
     await context.bot.send_message(chat_id=chat_id, text=f"🧩 **TRIVIA**: {response}", parse_mode='Markdown')
 
 # ==================== DANK MEME COMMANDS ====================
 
+# Every possible 0-10 bar, built once instead of multiplying emoji strings per command
+_HEART_BARS = tuple("💖" * i + "🤍" * (10 - i) for i in range(11))
+_RATING_STARS = tuple("⭐" * i + "☆" * (10 - i) for i in range(11))
+_RAINBOW_BARS = tuple("🏳️‍🌈" * i + "⬜" * (10 - i) for i in range(11))
+
+_MEME_SUBS = ("memes", "dankmemes", "me_irl", "shitposting", "whenthe")
+MEME_BATCH_SIZE = 25  # meme-api returns up to this many memes in one request
+MEME_CACHE_TTL = 60   # seconds before a subreddit's batch is refetched
+
+MEME_PREFETCH_AT = 5  # refill in the background once a batch is down to this many
+
+# {subreddit: (fetched_at, [meme, ...])}
+_MEME_CACHE = {}
+_MEME_FETCHES = {}  # subreddit -> in-flight fetch task, shared by everyone who needs that batch
+
+async def _fetch_memes(sub):
+    resp = await HTTP_CLIENT.get(f"https://meme-api.com/gimme/{sub}/{MEME_BATCH_SIZE}", timeout=10.0)
+    resp.raise_for_status()
+    memes = [meme for meme in orjson.loads(resp.content).get("memes", []) if meme.get("url")]
+    _MEME_CACHE[sub] = (time.monotonic(), memes)
+    return memes
+
+def fetch_memes(sub):
+    """Start (or join) the fetch of a fresh batch for sub, so a burst of !meme makes one request."""
+    task = _MEME_FETCHES.get(sub)
+    if task is None:
+        task = _MEME_FETCHES[sub] = asyncio.create_task(_fetch_memes(sub))
+        task.add_done_callback(lambda _: _MEME_FETCHES.pop(sub, None))
+    return task
+
+async def prefetch_memes(sub):
+    try:
+        await fetch_memes(sub)
+    except Exception as e:
+        logging.warning(f"⚠️ Meme prefetch for r/{sub} failed: {e}")
+
+async def get_meme(sub):
+    """Pop a random meme for sub, refilling the cache with one bulk request when needed."""
+    fetched_at, memes = _MEME_CACHE.get(sub, (0.0, []))
+    age = time.monotonic() - fetched_at
+    if not memes or age > MEME_CACHE_TTL:
+        # shield: a caller giving up shouldn't cancel the fetch the others are waiting on
+        memes = await asyncio.shield(fetch_memes(sub))
+        age = 0.0
+    if not memes:
+        return None
+    meme = memes.pop(_RNG.randrange(len(memes)))
+
+    # Running low or about to go stale: get the next batch now so the next !meme doesn't wait for it
+    if (len(memes) <= MEME_PREFETCH_AT or age > MEME_CACHE_TTL * 0.8) and sub not in _MEME_FETCHES:
+        _fire_and_forget(prefetch_memes(sub))
+    return meme
+
 async def meme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Fetch a random meme from Reddit"""
     chat_id = update.effective_chat.id
     try:
-        subreddits = ["memes", "dankmemes", "me_irl", "shitposting", "whenthe"]
-        sub = random.choice(subreddits)
-        resp = requests.get(
-            f"https://meme-api.com/gimme/{sub}",
-            timeout=10
-        )
-        if resp.status_code == 200:
-            data = resp.json()
+        sub = _RNG.choice(_MEME_SUBS)
+        data = await get_meme(sub)
+        if data:
             title = data.get("title", "meme")
-            img_url = data.get("url", "")
+            img_url = data["url"]
             sub_name = data.get("subreddit", sub)
-            if img_url:
-                caption = f"**{title}**\n\n_from r/{sub_name}_ 💀✨"
-                await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=img_url,
-                    caption=caption,
-                    parse_mode='Markdown'
-                )
-            else:
-                await context.bot.send_message(chat_id=chat_id, text="Couldn't find a meme~ 😭 try again!")
+            caption = f"**{title}**\n\n_from r/{sub_name}_ 💀✨"
+            await context.bot.send_photo(
+                chat_id=chat_id,
+                photo=img_url,
+                caption=caption,
+                parse_mode='Markdown'
+            )
         else:
-            await context.bot.send_message(chat_id=chat_id, text="Meme machine is being shy~ 🥺 try again!")
+            await context.bot.send_message(chat_id=chat_id, text="Couldn't find a meme~ 😭 try again!")
+    except httpx.HTTPStatusError:
+        await context.bot.send_message(chat_id=chat_id, text="Meme machine is being shy~ 🥺 try again!")
     except Exception as e:
         logging.error(f"Meme fetch error: {e}")
         await context.bot.send_message(chat_id=chat_id, text="Couldn't grab a meme right now~ 😭 try again!")
@@ -376,6 +666,8 @@ async def roast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Lovingly roast someone"""
     chat_id = update.effective_chat.id
     target = None
+    # Checked first so "!roast creative Bob" still roasts Bob
+    use_ai = wants_ai_game(context, _ROASTS)
 
     if update.message.reply_to_message and update.message.reply_to_message.from_user:
         target = update.message.reply_to_message.from_user.first_name
@@ -384,12 +676,15 @@ async def roast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         target = update.effective_user.first_name
 
-    response = await get_ai_response(
-        chat_id,
-        f"Give a playful, funny, loving roast about {target}. Be savage but in a cute way. Make it memey and hilarious. Keep it short (1-3 sentences). Don't be actually mean or hurtful. This is all love.",
-        user_name="RoastMaster",
-        chat_type="game"
-    )
+    if use_ai:
+        response = await get_ai_response(
+            chat_id,
+            f"Give a playful, funny, loving roast about {target}. Be savage but in a cute way. Make it memey and hilarious. Keep it short (1-3 sentences). Don't be actually mean or hurtful. This is all love.",
+            user_name="RoastMaster",
+            chat_type="game"
+        )
+    else:
+        response = _RNG.choice(_ROASTS).format(name=target)
     await context.bot.send_message(chat_id=chat_id, text=f"🔥 **ROAST for {target}**: {response}", parse_mode='Markdown')
 
 async def ship_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -410,26 +705,26 @@ async def ship_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=chat_id, text="I need two people to ship~ 😭\nUsage: `!ship name1 name2` or reply to someone!", parse_mode='Markdown')
         return
 
-    percentage = random.randint(0, 100)
+    percentage = _RNG.randint(0, 100)
 
     if percentage >= 90:
         verdict = "Soulmates!! Get married already~ 💒💍✨"
-        bar = "💖" * 10
+        bar = _HEART_BARS[10]
     elif percentage >= 70:
         verdict = "Ooh this works~ I see it! 👀💕"
-        bar = "💖" * 7 + "🤍" * 3
+        bar = _HEART_BARS[7]
     elif percentage >= 50:
         verdict = "There's something there~ maybe? 💫"
-        bar = "💖" * 5 + "🤍" * 5
+        bar = _HEART_BARS[5]
     elif percentage >= 30:
         verdict = "Hmm... maybe in another life~ 😅"
-        bar = "💖" * 3 + "🤍" * 7
+        bar = _HEART_BARS[3]
     elif percentage >= 10:
         verdict = "Not really seeing it~ sorry! 😶"
-        bar = "💖" * 1 + "🤍" * 9
+        bar = _HEART_BARS[1]
     else:
         verdict = "Nope nope nope~ 🚫😭"
-        bar = "🤍" * 10
+        bar = _HEART_BARS[0]
 
     # Generate ship name
     name1_half = person1[:len(person1)//2 + 1]
@@ -445,33 +740,33 @@ async def ship_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await context.bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
 
+_EIGHTBALL_RESPONSES = (
+    "yes absolutely!! 💖✨",
+    "hmm nope~ 😅",
+    "obviously yes, cutie!",
+    "the stars say... yes! 🌟",
+    "hmm ask me again later~ 🔮",
+    "noo I don't think so 😭",
+    "yesss go for it! 👑",
+    "ehh... that's a no from me ❌",
+    "my heart says yes~ 🤝",
+    "sorry hun... no 🥺",
+    "signs point to yesss 🎯",
+    "not right now~ 🌙",
+    "without a doubt!! 💕",
+    "hmm it's unclear, try again~ 🔮",
+    "yes yes yes!! 💖",
+    "outlook not so great, sorry 😢",
+    "definitely! go for it! 🚀",
+    "don't count on it, sweetie 😭",
+    "you already know the answer~ 💖",
+    "hmm maybe?? I'm not sure 🥺",
+)
+
 async def eightball_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Magic 8-ball with meme energy"""
-    responses = [
-        "yes absolutely!! 💖✨",
-        "hmm nope~ 😅",
-        "obviously yes, cutie!",
-        "the stars say... yes! 🌟",
-        "hmm ask me again later~ 🔮",
-        "noo I don't think so 😭",
-        "yesss go for it! 👑",
-        "ehh... that's a no from me ❌",
-        "my heart says yes~ 🤝",
-        "sorry hun... no 🥺",
-        "signs point to yesss 🎯",
-        "not right now~ 🌙",
-        "without a doubt!! 💕",
-        "hmm it's unclear, try again~ 🔮",
-        "yes yes yes!! 💖",
-        "outlook not so great, sorry 😢",
-        "definitely! go for it! 🚀",
-        "don't count on it, sweetie 😭",
-        "you already know the answer~ 💖",
-        "hmm maybe?? I'm not sure 🥺",
-    ]
-
     question = " ".join(context.args) if context.args else "your question"
-    answer = random.choice(responses)
+    answer = _RNG.choice(_EIGHTBALL_RESPONSES)
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -479,6 +774,18 @@ async def eightball_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+# r/l -> w is a plain character swap, done with a translate table
+_UWU_TABLE = str.maketrans("rlRL", "wwWW")
+# The context-sensitive rules as one alternation. The n-rules use a lookahead so the
+# vowel stays available for the "ove" rule, same result as applying them one by one.
+_UWU_RE = re.compile(r'(?P<ny>n(?=[aeiou]))|(?P<NY>N(?=[aeiouAEIOU]))|(?P<uv>ove)|(?P<UV>OVE)')
+_UWU_SUBS = {"ny": "ny", "NY": "NY", "uv": "uv", "UV": "UV"}
+
+def _uwu_repl(match):
+    return _UWU_SUBS[match.lastgroup]
+
+_UWU_SUFFIXES = (" OwO", " UwU", " >w<", " ~nyaa", " (⁄ ⁄>⁄ ▽ ⁄<⁄ ⁄)", " ✨", " 💖", " :3", " ~desu")
+
 async def uwu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """UwUify text"""
     if update.message.reply_to_message and update.message.reply_to_message.text:
@@ -493,20 +800,11 @@ async def uwu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # UwUify the text
-    uwu_text = text
-    replacements = [
-        (r'[rl]', 'w'), (r'[RL]', 'W'),
-        (r'n([aeiou])', r'ny\1'), (r'N([aeiou])', r'NY\1'),
-        (r'N([AEIOU])', r'NY\1'),
-        (r'ove', 'uv'), (r'OVE', 'UV'),
-    ]
-    for pattern, replacement in replacements:
-        uwu_text = re.sub(pattern, replacement, uwu_text)
+    # UwUify the text (all rules in one pass)
+    uwu_text = _UWU_RE.sub(_uwu_repl, text.translate(_UWU_TABLE))
 
     # Add random kawaii suffixes
-    suffixes = [" OwO", " UwU", " >w<", " ~nyaa", " (⁄ ⁄>⁄ ▽ ⁄<⁄ ⁄)", " ✨", " 💖", " :3", " ~desu"]
-    uwu_text += random.choice(suffixes)
+    uwu_text += _RNG.choice(_UWU_SUFFIXES)
 
     await context.bot.send_message(chat_id=update.effective_chat.id, text=uwu_text)
 
@@ -524,7 +822,7 @@ async def rate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    rating = random.randint(0, 10)
+    rating = _RNG.randint(0, 10)
 
     if rating >= 9:
         comment = "Amazing!! Absolutely love it~ 👑✨"
@@ -539,7 +837,7 @@ async def rate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         comment = "Oh no... 🥺 maybe try something else?"
 
-    stars = "⭐" * rating + "☆" * (10 - rating)
+    stars = _RATING_STARS[rating]
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -547,6 +845,24 @@ async def rate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+_VIBES = (
+    ("main character energy", "🎬✨"),
+    ("NPC energy~", "🧍😅"),
+    ("adorable menace", "😈🔥"),
+    ("certified cutie", "🥺💖"),
+    ("chaotic good", "🌪️✨"),
+    ("always online", "📱✨"),
+    ("nature lover energy", "🌱🌸"),
+    ("royalty energy", "👑💕"),
+    ("cool and mysterious", "🗿✨"),
+    ("wholesome sweetie", "🥹💕"),
+    ("golden retriever energy", "🐕✨"),
+    ("elegant cat energy", "🐈‍⬛🖤"),
+    ("adorably chaotic", "🤪💖"),
+    ("the quiet mysterious one", "🤫✨"),
+    ("living their best life", "🌟😊"),
+)
+
 async def vibe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check someone's vibe"""
     if update.message.reply_to_message and update.message.reply_to_message.from_user:
@@ -556,26 +872,8 @@ async def vibe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         target = update.effective_user.first_name if update.effective_user else "you"
 
-    vibes = [
-        ("main character energy", "🎬✨"),
-        ("NPC energy~", "🧍😅"),
-        ("adorable menace", "😈🔥"),
-        ("certified cutie", "🥺💖"),
-        ("chaotic good", "🌪️✨"),
-        ("always online", "📱✨"),
-        ("nature lover energy", "🌱🌸"),
-        ("royalty energy", "👑💕"),
-        ("cool and mysterious", "🗿✨"),
-        ("wholesome sweetie", "🥹💕"),
-        ("golden retriever energy", "🐕✨"),
-        ("elegant cat energy", "🐈‍⬛🖤"),
-        ("adorably chaotic", "🤪💖"),
-        ("the quiet mysterious one", "🤫✨"),
-        ("living their best life", "🌟😊"),
-    ]
-
-    vibe, emoji = random.choice(vibes)
-    percentage = random.randint(1, 100)
+    vibe, emoji = _RNG.choice(_VIBES)
+    percentage = _RNG.randint(1, 100)
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -624,6 +922,19 @@ async def is_user_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, us
         logging.warning(f"Failed to check if user {user_id} is in chat: {e}")
         return False
 
+async def check_target_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Return (in_chat, is_admin) for a moderation target, with both API calls made at once"""
+    return await asyncio.gather(
+        is_user_in_chat(update, context, user_id),
+        is_target_admin(update, context, user_id),
+    )
+
+# Telethon lookups are a full MTProto round-trip (and count against flood limits),
+# so resolved users are kept for a while: lowercased username -> (resolved_at, user)
+_TELETHON_USER_CACHE = OrderedDict()
+TELETHON_CACHE_MAX = 512
+TELETHON_CACHE_TTL = 3600  # seconds, usernames can change hands
+
 async def resolve_username_with_telethon(username):
     """Use Telethon to resolve a username to a user ID and details"""
     global telethon_client
@@ -631,13 +942,21 @@ async def resolve_username_with_telethon(username):
     if not telethon_client:
         return None
     
+    # Clean username
+    clean_username = username.lstrip("@")
+    cache_key = clean_username.lower()
+    cached = _TELETHON_USER_CACHE.get(cache_key)
+    if cached and time.monotonic() - cached[0] < TELETHON_CACHE_TTL:
+        _TELETHON_USER_CACHE.move_to_end(cache_key)
+        return cached[1]
+
     try:
-        # Clean username
-        clean_username = username.lstrip("@")
-        
-        # Get user info via Telethon
-        user_full = await telethon_client(GetFullUserRequest(clean_username))
-        user = user_full.users[0]
+        # Get user info via Telethon. get_entity only resolves the username (and is answered from
+        # the session's entity cache when it can); the full profile from GetFullUserRequest isn't needed
+        user = await telethon_client.get_entity(clean_username)
+        if not isinstance(user, TelethonUser):
+            logging.warning(f"Telethon: @{clean_username} is not a user")
+            return None
         
         # Track this user in our database
         db.track_user(user.id, user.username, user.first_name)
@@ -652,7 +971,12 @@ async def resolve_username_with_telethon(username):
                 self.is_bot = getattr(tg_user, 'bot', False)
         
         logging.info(f"✅ Telethon resolved @{clean_username} -> User ID: {user.id}")
-        return MockUser(user)
+        resolved = MockUser(user)
+        _TELETHON_USER_CACHE[cache_key] = (time.monotonic(), resolved)
+        _TELETHON_USER_CACHE.move_to_end(cache_key)
+        if len(_TELETHON_USER_CACHE) > TELETHON_CACHE_MAX:
+            _TELETHON_USER_CACHE.popitem(last=False)
+        return resolved
     
     except (UsernameNotOccupiedError, UsernameInvalidError):
         logging.warning(f"Telethon: Username @{username} not found")
@@ -768,12 +1092,13 @@ async def warn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Check if user is in the group
     chat_id = update.effective_chat.id
-    if not await is_user_in_chat(update, context, target_user.id):
+    in_chat, target_is_admin = await check_target_in_chat(update, context, target_user.id)
+    if not in_chat:
         await update.message.reply_text(f"Umm... {target_user.first_name} isn't even in this group anymore, silly! 🥺\nThey must have left or been removed already~ ✨")
         return
 
     # Protect admins
-    if await is_target_admin(update, context, target_user.id):
+    if target_is_admin:
         await update.message.reply_text("I am not gonna warn an admin you dumboo! 🙄💅✨")
         return
 
@@ -801,7 +1126,7 @@ async def warn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             reason = " ".join(args_for_reason)
 
-    if target_user.id == context.bot.id:
+    if target_user.id == BOT_ID:
         await update.message.reply_text("Wait, why are you trying to warn me?? 😭")
         return
 
@@ -883,12 +1208,13 @@ async def mute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     # Check if user is in the group
-    if not await is_user_in_chat(update, context, target_user.id):
+    in_chat, target_is_admin = await check_target_in_chat(update, context, target_user.id)
+    if not in_chat:
         await update.message.reply_text(f"Umm... {target_user.first_name} isn't even in this group anymore, sweetie! 🥺\nCan't mute someone who's already gone~ 💫")
         return
     
     # Protect admins
-    if await is_target_admin(update, context, target_user.id):
+    if target_is_admin:
         await update.message.reply_text("I'm not muting an admin, sillie! They're important! 🥺💖")
         return
 
@@ -927,6 +1253,17 @@ async def mute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"Failed to mute: {e}")
 
+# Member permissions used by unmute/lock/unlock, built once (ChatPermissions is immutable)
+_PERMISSION_FIELDS = (
+    "can_send_messages", "can_send_audios", "can_send_documents", "can_send_photos",
+    "can_send_videos", "can_send_video_notes", "can_send_voice_notes", "can_send_polls",
+    "can_send_other_messages", "can_add_web_page_previews", "can_change_info",
+    "can_invite_users", "can_pin_messages",
+)
+DEFAULT_PERMISSIONS = ChatPermissions(**dict.fromkeys(_PERMISSION_FIELDS, True))
+LOCKED_PERMISSIONS = ChatPermissions(**dict.fromkeys(_PERMISSION_FIELDS, False))
+_DURATION_UNITS = {"m": 1, "h": 60, "d": 1440}  # minutes per unit in "duration:" args
+
 async def unmute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Unmute a user"""
     if not await is_admin(update, context): return
@@ -953,22 +1290,7 @@ async def unmute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db.log_admin_action(chat_id, update.effective_user.id, "unmute", target_user.id)
     
     try:
-        permissions = ChatPermissions(
-            can_send_messages=True,
-            can_send_audios=True,
-            can_send_documents=True,
-            can_send_photos=True,
-            can_send_videos=True,
-            can_send_video_notes=True,
-            can_send_voice_notes=True,
-            can_send_polls=True,
-            can_send_other_messages=True,
-            can_add_web_page_previews=True,
-            can_change_info=True,
-            can_invite_users=True,
-            can_pin_messages=True
-        )
-        await context.bot.restrict_chat_member(chat_id, target_user.id, permissions)
+        await context.bot.restrict_chat_member(chat_id, target_user.id, DEFAULT_PERMISSIONS)
         await update.message.reply_text(f"✨ **{target_user.first_name} is no longer muted!**")
     except Exception as e:
         await update.message.reply_text(f"Failed to unmute: {e}")
@@ -992,12 +1314,13 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     # Check if user is in the group
-    if not await is_user_in_chat(update, context, target_user.id):
+    in_chat, target_is_admin = await check_target_in_chat(update, context, target_user.id)
+    if not in_chat:
         await update.message.reply_text(f"Ummm... {target_user.first_name} already left the group, babe! 🥺\nNo need to ban someone who's not even here~ 💕")
         return
     
     # Protect admins
-    if await is_target_admin(update, context, target_user.id):
+    if target_is_admin:
         await update.message.reply_text("Banning an admin? Are you crazy? I'd never do that to them! 😤💕")
         return
 
@@ -1028,12 +1351,13 @@ async def kick_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     # Check if user is in the group
-    if not await is_user_in_chat(update, context, target_user.id):
+    in_chat, target_is_admin = await check_target_in_chat(update, context, target_user.id)
+    if not in_chat:
         await update.message.reply_text(f"Ehehe~ {target_user.first_name} isn't in the group anymore! 🥺\nThey already left, so no kicking needed~ 👟💫")
         return
     
     # Protect admins
-    if await is_target_admin(update, context, target_user.id):
+    if target_is_admin:
         await update.message.reply_text("I can't kick an admin! That's mean and they have work to do! 👟❌🥺")
         return
 
@@ -1193,32 +1517,17 @@ async def lock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         for arg in context.args:
             if arg.startswith("duration:"):
-                try:
-                    d_str = arg[9:]
-                    if d_str.endswith("m"): duration_mins = int(d_str[:-1])
-                    elif d_str.endswith("h"): duration_mins = int(d_str[:-1]) * 60
-                    elif d_str.endswith("d"): duration_mins = int(d_str[:-1]) * 1440
-                except:
-                    pass
+                d_str = arg[9:]
+                unit = _DURATION_UNITS.get(d_str[-1:])
+                if unit:
+                    try:
+                        duration_mins = int(d_str[:-1]) * unit
+                    except ValueError:
+                        pass
 
     try:
         # Disable all permissions for members
-        permissions = ChatPermissions(
-            can_send_messages=False,
-            can_send_audios=False,
-            can_send_documents=False,
-            can_send_photos=False,
-            can_send_videos=False,
-            can_send_video_notes=False,
-            can_send_voice_notes=False,
-            can_send_polls=False,
-            can_send_other_messages=False,
-            can_add_web_page_previews=False,
-            can_change_info=False,
-            can_invite_users=False,
-            can_pin_messages=False
-        )
-        await context.bot.set_chat_permissions(chat_id, permissions)
+        await context.bot.set_chat_permissions(chat_id, LOCKED_PERMISSIONS)
         
         msg = "🔒 **Chat has been locked!** Only admins can speak now. 🤫"
         if duration_mins:
@@ -1237,22 +1546,7 @@ async def auto_unlock_job(context: ContextTypes.DEFAULT_TYPE):
     """Job to automatically unlock a chat"""
     chat_id = context.job.chat_id
     try:
-        permissions = ChatPermissions(
-            can_send_messages=True,
-            can_send_audios=True,
-            can_send_documents=True,
-            can_send_photos=True,
-            can_send_videos=True,
-            can_send_video_notes=True,
-            can_send_voice_notes=True,
-            can_send_polls=True,
-            can_send_other_messages=True,
-            can_add_web_page_previews=True,
-            can_change_info=True,
-            can_invite_users=True,
-            can_pin_messages=True
-        )
-        await context.bot.set_chat_permissions(chat_id, permissions)
+        await context.bot.set_chat_permissions(chat_id, DEFAULT_PERMISSIONS)
         await context.bot.send_message(chat_id, "🔓 **Chat auto-unlocked!** Everyone can speak again. ✨")
     except Exception as e:
         logging.error(f"Auto-unlock job failed for {chat_id}: {e}")
@@ -1264,22 +1558,7 @@ async def unlock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     try:
         # Restore default permissions
-        permissions = ChatPermissions(
-            can_send_messages=True,
-            can_send_audios=True,
-            can_send_documents=True,
-            can_send_photos=True,
-            can_send_videos=True,
-            can_send_video_notes=True,
-            can_send_voice_notes=True,
-            can_send_polls=True,
-            can_send_other_messages=True,
-            can_add_web_page_previews=True,
-            can_change_info=True,
-            can_invite_users=True,
-            can_pin_messages=True
-        )
-        await context.bot.set_chat_permissions(chat_id, permissions)
+        await context.bot.set_chat_permissions(chat_id, DEFAULT_PERMISSIONS)
         await update.message.reply_text("🔓 **Chat has been unlocked!** Everyone can speak again. ✨")
         db.log_admin_action(chat_id, update.effective_user.id, "unlock")
     except Exception as e:
@@ -1318,11 +1597,8 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "exported_at": datetime.now().isoformat()
     }
     
-    import json
-    json_str = json.dumps(export_data, indent=2)
-    
     from io import BytesIO
-    bio = BytesIO(json_str.encode())
+    bio = BytesIO(orjson.dumps(export_data, option=orjson.OPT_INDENT_2))
     bio.name = f"iris_settings_{chat_id}.json"
     
     await context.bot.send_document(
@@ -1351,8 +1627,7 @@ async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file = await context.bot.get_file(doc.file_id)
         content = await file.download_as_bytearray()
         
-        import json
-        data = json.loads(content.decode())
+        data = orjson.loads(content)
         
         # Validation (Basic)
         if "chat_settings" not in data or "mod_settings" not in data:
@@ -2149,8 +2424,31 @@ async def cleanup_job(context: ContextTypes.DEFAULT_TYPE):
     # Ideally, we'd iterate through chats, but db.py currently doesn't have a list_chats.
     # Let's assume a global cleanup for now or add a helper.
     db.delete_old_messages(30) # Default 30 days for now
+    forget_history()
     logging.info("🧹 Periodic log cleanup completed.")
 
+STATE_IDLE_SECONDS = 3600  # per-user anti-spam state older than this is dropped by the sweep
+
+async def sweep_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Drop idle anti-spam state and expired lookups in one pass, instead of letting them pile up."""
+    now = time.time()
+    cutoff = now - STATE_IDLE_SECONDS
+
+    for chat_id in list(flood_tracker):
+        users = flood_tracker[chat_id]
+        for user_id in [uid for uid, stamps in users.items() if not stamps or stamps[-1] < cutoff]:
+            del users[user_id]
+        if not users:
+            del flood_tracker[chat_id]
+    for key in [key for key, flood in flood_data.items() if flood["last_time"] < cutoff]:
+        del flood_data[key]
+    for user_id in [uid for uid, last in command_cooldowns.items() if last < cutoff]:
+        del command_cooldowns[user_id]
+
+    expiry = time.monotonic() - TELETHON_CACHE_TTL
+    for username in [name for name, (resolved_at, _) in _TELETHON_USER_CACHE.items() if resolved_at < expiry]:
+        del _TELETHON_USER_CACHE[username]
+
 async def pp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """The classic pp size command"""
     if update.message.reply_to_message and update.message.reply_to_message.from_user:
@@ -2158,7 +2456,7 @@ async def pp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         target = update.effective_user.first_name if update.effective_user else "you"
 
-    size = random.randint(1, 12)
+    size = _RNG.randint(1, 12)
     pp = "8" + "=" * size + "D"
 
     await context.bot.send_message(
@@ -2174,9 +2472,8 @@ async def howgay_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         target = update.effective_user.first_name if update.effective_user else "you"
 
-    percentage = random.randint(0, 100)
-    bar_filled = percentage // 10
-    bar = "🏳️‍🌈" * bar_filled + "⬜" * (10 - bar_filled)
+    percentage = _RNG.randint(0, 100)
+    bar = _RAINBOW_BARS[percentage // 10]
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -2191,7 +2488,7 @@ async def simprate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         target = update.effective_user.first_name if update.effective_user else "you"
 
-    percentage = random.randint(0, 100)
+    percentage = _RNG.randint(0, 100)
 
     if percentage >= 90:
         verdict = "Hopeless romantic~ no saving them! 📉💕"
@@ -2210,57 +2507,81 @@ async def simprate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+# Stop generating when the model starts writing another "Iris:" turn itself.
+# Newline-anchored so a reply that merely *starts* with a prefix isn't cut to nothing
+# (that case is still handled by clean_ai_reply below).
+REPLY_STOP_SEQUENCES = ["\n[Iris]:", "\nIris:"]
+
+# Reply cleanup patterns (compiled once, used on every AI reply)
+# Leading "[Name]:" / "[Name]" / "Iris:" prefixes, however many are stacked - one anchored pass.
+# Only known bot-name prefixes are stripped, not arbitrary "word:" patterns.
+_REPLY_PREFIX_RE = re.compile(r'^(?:\[[^\]\n]*\]:?\s*|(?:Iris|iris|IRIS)\s*:\s*)+')
+# Brackets around names in the middle of sentences
+_BRACKETED_NAME_RE = re.compile(r'\[([^\]]+)\]')
+
 def clean_ai_reply(reply):
     """Clean up AI response prefixes without being too aggressive."""
     if not reply:
         return reply
-    # Remove [Name]: or [Name] prefix at start
-    reply = re.sub(r'^\[.*?\]:?\s*', '', reply)
-    # Only strip known bot-name prefixes, not arbitrary "word:" patterns
-    reply = re.sub(r'^(?:Iris|iris|IRIS)\s*:\s*', '', reply)
-    # Remove brackets around names in the middle of sentences
-    reply = re.sub(r'\[([^\]]+)\]', r'\1', reply)
+    reply = _REPLY_PREFIX_RE.sub('', reply, count=1)
+    reply = _BRACKETED_NAME_RE.sub(r'\1', reply)
     return reply.strip()
 
-def get_groq_response_sync(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP):
-    try:
-        # Format history to include names
-        formatted_history = []
-        for msg in history:
-            role = msg["role"]
-            content = msg["content"]
-            name = msg.get("sender_name")
-            
-            if role == "user" and name:
-                content = f"[{name}]: {content}"
-            
-            formatted_history.append({"role": role, "content": content})
+def _format_turn(role, content, name):
+    # Users' names go in [brackets] so the model knows who said what
+    return f"[{name}]: {content}" if role == "user" and name else content
+
+def _rendered(msg):
+    # History rows come with the "[name]: text" form already built by db.get_history
+    if "prerendered" in msg:
+        return msg["prerendered"]
+    return _format_turn(msg["role"], msg["content"], msg.get("sender_name"))
+
+# System messages for the fixed prompts, built once (providers only read them)
+_SYSTEM_MESSAGES = {
+    prompt: {"role": "system", "content": prompt}
+    for prompt in (SYSTEM_PROMPT_DM, SYSTEM_PROMPT_GROUP)
+}
+
+def build_chat_messages(user_text, history, user_name, system_prompt):
+    """Build the role/content message list shared by the chat-style providers."""
+    system_msg = _SYSTEM_MESSAGES.get(system_prompt) or {"role": "system", "content": system_prompt}
+    # Built in one go instead of growing the list with extend/append
+    return [
+        system_msg,
+        *[{"role": msg["role"], "content": _rendered(msg)} for msg in history],
+        {"role": "user", "content": _format_turn("user", user_text, user_name)},
+    ]
 
-        messages = [{"role": "system", "content": system_prompt}] + formatted_history
-        
-        # Add current message with name
-        current_content = user_text
-        if user_name:
-            current_content = f"[{user_name}]: {user_text}"
-            
-        messages.append({"role": "user", "content": current_content})
+async def get_groq_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP, on_partial=None):
+    try:
+        messages = build_chat_messages(user_text, history, user_name, system_prompt)
 
         # Rotate keys per request for load balancing
         current_key = get_random_key(GROQ_API_KEY) if GROQ_API_KEY else None
-        client = Groq(api_key=current_key) if current_key else groq_client
-        if not client:
+        if not current_key:
             raise Exception("Groq client not initialized")
+        client = get_groq_client(current_key)
 
-        completion = client.chat.completions.create(
+        completion = await client.chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=messages,
             temperature=0.9,
             max_tokens=1024,
             top_p=1,
-            stop=None,
-            stream=False
+            stop=REPLY_STOP_SEQUENCES,
+            stream=on_partial is not None
         )
-        reply = completion.choices[0].message.content
+        if on_partial:
+            # Streamed: pass the text so far to on_partial as the deltas come in
+            reply = ""
+            async for chunk in completion:
+                piece = chunk.choices[0].delta.content if chunk.choices else None
+                if piece:
+                    reply += piece
+                    on_partial(reply)
+        else:
+            reply = completion.choices[0].message.content
         
         if reply:
             reply = clean_ai_reply(reply)
@@ -2269,7 +2590,7 @@ def get_groq_response_sync(user_text, history, user_name=None, system_prompt=SYS
         logging.error(f"Groq API Error: {e}")
         return None
 
-async def get_gemini_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP):
+async def get_gemini_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP, on_partial=None):
     try:
         # Gemini 2.0 / New SDK Format
         # Convert history to Gemini format if needed, but the new SDK is flexible.
@@ -2277,26 +2598,18 @@ async def get_gemini_response(user_text, history, user_name=None, system_prompt=
         
         # Rotate keys per request for load balancing
         current_key = get_random_key(GEMINI_API_KEY) if GEMINI_API_KEY else None
-        client = genai.Client(api_key=current_key) if current_key else gemini_client
+        client = get_gemini_client(current_key) if current_key else gemini_client
         if not client:
             raise Exception("Gemini client not initialized")
 
-        full_prompt = f"{system_prompt}\n\n"
-        for msg in history:
-            role = msg["role"]
-            content = msg["content"]
-            name = msg.get("sender_name")
-            if role == "user" and name:
-                full_prompt += f"[{name}]: {content}\n"
-            else:
-                full_prompt += f"{content}\n"
-        
-        if user_name:
-            full_prompt += f"[{user_name}]: {user_text}\n"
-        else:
-            full_prompt += f"{user_text}\n"
+        # Collect the lines and join once instead of growing a string with +=
+        parts = [system_prompt, ""]
+        parts.extend(_rendered(msg) for msg in history)
+        parts.append(_format_turn("user", user_text, user_name))
+        parts.append("")
+        full_prompt = "\n".join(parts)
 
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model='gemini-2.0-flash', 
             contents=full_prompt
         )
@@ -2309,42 +2622,41 @@ async def get_gemini_response(user_text, history, user_name=None, system_prompt=
         logging.error(f"Gemini API Error: {e}")
         return None
 
-def get_ollama_response_sync(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP):
+async def get_ollama_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP, on_partial=None):
     try:
-        # Format history
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        for msg in history:
-            role = msg["role"]
-            content = msg["content"]
-            name = msg.get("sender_name")
-            
-            if role == "user" and name:
-                content = f"[{name}]: {content}"
-            
-            messages.append({"role": role, "content": content})
-            
-        current_content = user_text
-        if user_name:
-            current_content = f"[{user_name}]: {user_text}"
-            
-        messages.append({"role": "user", "content": current_content})
+        messages = build_chat_messages(user_text, history, user_name, system_prompt)
         
         payload = {
             "model": OLLAMA_MODEL,
             "messages": messages,
-            "stream": False,
+            "stream": True,
             "options": {
                 "temperature": 0.9,
                 "top_p": 0.9,
+                "stop": REPLY_STOP_SEQUENCES,
             }
         }
         
-        response = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
-        reply = result.get("message", {}).get("content", "")
+        # Ollama streams one JSON object per line; pass the text so far to on_partial as it grows
+        reply = ""
+        async with HTTP_CLIENT.stream(
+            "POST",
+            f"{OLLAMA_BASE_URL}/api/chat",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                piece = chunk.get("message", {}).get("content", "")
+                if piece:
+                    reply += piece
+                    if on_partial:
+                        on_partial(reply)
+                if chunk.get("done"):
+                    break
         
         if reply:
             reply = clean_ai_reply(reply)
@@ -2354,29 +2666,14 @@ def get_ollama_response_sync(user_text, history, user_name=None, system_prompt=S
         logging.error(f"Ollama API Error: {e}")
         return None
 
-async def get_mistral_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP):
+async def get_mistral_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP, on_partial=None):
     try:
         if not mistral_client:
             raise Exception("Mistral client not initialized")
             
         # Mistral uses ChatMessage objects
-        messages = [ChatMessage(role="system", content=system_prompt)]
-        
-        for msg in history:
-            role = msg["role"]
-            content = msg["content"]
-            name = msg.get("sender_name")
-            
-            if role == "user" and name:
-                content = f"[{name}]: {content}"
-            
-            messages.append(ChatMessage(role=role, content=content))
-            
-        current_content = user_text
-        if user_name:
-            current_content = f"[{user_name}]: {user_text}"
-            
-        messages.append(ChatMessage(role="user", content=current_content))
+        from mistralai.models.chat_completion import ChatMessage
+        messages = [ChatMessage(**msg) for msg in build_chat_messages(user_text, history, user_name, system_prompt)]
         
         completion = await mistral_client.chat(
             model="mistral-tiny", # Free tier model
@@ -2396,36 +2693,20 @@ async def get_mistral_response(user_text, history, user_name=None, system_prompt
         logging.error(f"Mistral API Error: {e}")
         return None
 
-def get_openrouter_response_sync(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP):
+async def get_openrouter_response(user_text, history, user_name=None, system_prompt=SYSTEM_PROMPT_GROUP, on_partial=None):
     try:
         # Get random key for this request
         api_key = get_random_key(OPENROUTER_API_KEY)
         if not api_key:
              raise Exception("No OpenRouter API key available")
 
-        # Format history
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        for msg in history:
-            role = msg["role"]
-            content = msg["content"]
-            name = msg.get("sender_name")
-            
-            if role == "user" and name:
-                content = f"[{name}]: {content}"
-            
-            messages.append({"role": role, "content": content})
-            
-        current_content = user_text
-        if user_name:
-            current_content = f"[{user_name}]: {user_text}"
-            
-        messages.append({"role": "user", "content": current_content})
+        messages = build_chat_messages(user_text, history, user_name, system_prompt)
         
         headers = {
             "Authorization": f"Bearer {api_key}",
             "HTTP-Referer": "https://telegram.org", # Required by OpenRouter
-            "X-Title": "IrisChat Bot"
+            "X-Title": "IrisChat Bot",
+            "Content-Type": "application/json",
         }
         
         payload = {
@@ -2433,13 +2714,14 @@ def get_openrouter_response_sync(user_text, history, user_name=None, system_prom
             "messages": messages,
             "temperature": 0.9,
             "top_p": 0.9,
-            "max_tokens": 1024
+            "max_tokens": 1024,
+            "stop": REPLY_STOP_SEQUENCES,
         }
         
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload, timeout=30)
+        response = await HTTP_CLIENT.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, content=orjson.dumps(payload))
         response.raise_for_status()
         
-        result = response.json()
+        result = orjson.loads(response.content)
         reply = result['choices'][0]['message']['content']
         
         if reply:
@@ -2450,7 +2732,106 @@ def get_openrouter_response_sync(user_text, history, user_name=None, system_prom
         logging.error(f"OpenRouter API Error: {e}")
         return None
 
-async def get_ai_response(chat_id, user_text, user_name=None, chat_type="group"):
+_BACKGROUND_TASKS = set()  # strong refs so pending tasks aren't garbage collected
+
+def _log_task_error(task):
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and task.exception():
+        # Reactions/typing might be disabled or not supported in some contexts
+        logging.debug(f"Background task failed: {task.exception()}")
+
+def _fire_and_forget(coro):
+    """Run a coroutine in the background without waiting for it."""
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_log_task_error)
+    return task
+
+# All provider functions share one signature; on_partial is only used by the streaming ones
+_PROVIDER_FUNCS = {
+    "ollama": get_ollama_response,
+    "groq": get_groq_response,
+    "gemini": get_gemini_response,
+    "mistral": get_mistral_response,
+    "openrouter": get_openrouter_response,
+}
+
+# (name, function) for each enabled provider in order, bound once in post_init
+LLM_CHAIN = []
+
+# Providers whose replies show up in the chat while they're generated (see ReplyStreamer)
+STREAMING_PROVIDERS = {"ollama", "groq"}
+
+async def _generate_reply(user_text, history, user_name, system_prompt, on_partial=None):
+    """Try each enabled provider in order and return the first non-empty reply."""
+    reply = None
+
+    # Try providers in order
+    for provider, generate in LLM_CHAIN:
+        try:
+            logging.info(f"🤔 Thinking with {provider}...")
+            reply = await generate(user_text, history, user_name, system_prompt, on_partial)
+            
+            if reply:
+                logging.info(f"✅ Response generated by {provider}")
+                break # Stop if successful
+            else:
+                logging.warning(f"⚠️ {provider} returned empty response. Trying next...")
+        
+        except Exception as e:
+            logging.error(f"❌ Error with {provider}: {e}")
+            continue # Try next provider
+
+    return reply
+
+SUMMARY_BATCH = 10  # summarize once this many messages have scrolled out of the history window
+SUMMARY_PROMPT = """You keep the memory of a group chat assistant called Iris.
+Summarize the conversation below in at most 5 short sentences.
+Keep names, facts about people, and anything Iris was asked to remember.
+Reply with the summary only."""
+_SUMMARIZING = set()  # chat_ids with a summary in progress
+
+async def summarize_old_history(chat_id):
+    """Compress messages older than the history window into one summary row."""
+    loop = asyncio.get_running_loop()
+    resets = _HISTORY_RESETS.get(chat_id, 0)
+    try:
+        # DB work goes through the single writer thread, off the event loop
+        old_messages = await loop.run_in_executor(db.WRITER, db.get_messages_before_window, chat_id, MAX_HISTORY)
+        if sum(1 for msg in old_messages if msg["role"] != "system") < SUMMARY_BATCH:
+            return
+
+        lines = []
+        for msg in old_messages:
+            if msg["role"] == "system":
+                lines.append(msg["content"])
+            elif msg["role"] == "assistant":
+                lines.append(f"Iris: {msg['content']}")
+            else:
+                lines.append(f"[{msg['sender_name'] or 'User'}]: {msg['content']}")
+
+        summary = await _generate_reply("\n".join(lines), [], None, SUMMARY_PROMPT)
+        if summary:
+            summary = f"Summary of earlier conversation: {summary}"
+            await loop.run_in_executor(db.WRITER, db.summarize_history, chat_id, old_messages[-1]["id"], summary)
+            # A !reset meanwhile is fine in the DB (its wipe runs on the writer too, so either the
+            # rows are already gone or they get wiped after this), but don't re-cache the summary
+            if _HISTORY_RESETS.get(chat_id, 0) == resets:
+                remember_summary(chat_id, summary)
+            logging.info(f"🧠 Summarized {len(old_messages)} old messages for chat {chat_id}")
+    except Exception as e:
+        logging.error(f"Error summarizing history for {chat_id}: {e}")
+    finally:
+        _SUMMARIZING.discard(chat_id)
+
+async def persist_turn(chat_id, turn, summarize=False):
+    """Write a user/assistant turn to the DB, then summarize old history if asked."""
+    await asyncio.get_running_loop().run_in_executor(db.WRITER, db.add_messages, chat_id, turn)
+    # Summarizing reads the rows just written, so it runs after them
+    if summarize:
+        await summarize_old_history(chat_id)
+
+async def get_ai_response(chat_id, user_text, user_name=None, chat_type="group", on_partial=None):
     if not ENABLED_PROVIDERS:
          return "I'm having trouble thinking right now. 😵‍💫 (No AI Provider)"
 
@@ -2477,52 +2858,214 @@ CRITICAL RULES:
     else:
         # Normal mode
         # Llama 3.1 8B is smart enough for the full persona prompt!
-        system_prompt = SYSTEM_PROMPT_DM if chat_type == "private" else SYSTEM_PROMPT_GROUP
+        system_prompt = _SYSTEM_PROMPT_BY_TYPE.get(chat_type, SYSTEM_PROMPT_GROUP)
+
+    # Game prompts repeat a lot, so answer them from the cache when we can.
+    # Each prompt has a small pool of slots and a random one is used per call, to keep some variety.
+    cache_key = None
+    if chat_type == "game":
+        slot = _RNG.randrange(ai_cache.GAME_POOL_SIZE)
+        cache_key = ai_cache.make_key(ENABLED_PROVIDERS[0], OLLAMA_MODEL, system_prompt, user_text, slot)
+    elif CACHE_REPLAY:
+        # Dev/testing only: replay the same reply for the same message
+        cache_key = ai_cache.make_key(ENABLED_PROVIDERS[0], OLLAMA_MODEL, system_prompt, user_name, user_text)
+    reply = await asyncio.to_thread(ai_cache.get_reply, cache_key) if cache_key else None
+    history = []
 
-    # Get history from DB
-    history = db.get_history(chat_id, limit=MAX_HISTORY)
-    
-    reply = None
-
-    # Try providers in order
-    for provider in ENABLED_PROVIDERS:
-        try:
-            logging.info(f"🤔 Thinking with {provider}...")
-            if provider == "ollama":
-                loop = asyncio.get_running_loop()
-                reply = await loop.run_in_executor(None, get_ollama_response_sync, user_text, history, user_name, system_prompt)
-            elif provider == "groq":
-                loop = asyncio.get_running_loop()
-                reply = await loop.run_in_executor(None, get_groq_response_sync, user_text, history, user_name, system_prompt)
-            elif provider == "gemini":
-                reply = await get_gemini_response(user_text, history, user_name, system_prompt)
-            elif provider == "mistral":
-                reply = await get_mistral_response(user_text, history, user_name, system_prompt)
-            elif provider == "openrouter":
-                loop = asyncio.get_running_loop()
-                reply = await loop.run_in_executor(None, get_openrouter_response_sync, user_text, history, user_name, system_prompt)
-            
-            if reply:
-                logging.info(f"✅ Response generated by {provider}")
-                break # Stop if successful
-            else:
-                logging.warning(f"⚠️ {provider} returned empty response. Trying next...")
+    if not reply:
+        # Get history (from memory once the chat is warm)
+        history = get_cached_history(chat_id)
         
-        except Exception as e:
-            logging.error(f"❌ Error with {provider}: {e}")
-            continue # Try next provider
+        reply = await _generate_reply(user_text, history, user_name, system_prompt, on_partial)
+        if reply and cache_key:
+            await asyncio.to_thread(ai_cache.put_reply, cache_key, reply)
 
     if reply:
         # Save interaction to DB
         privacy_on = settings.get("privacy_mode", 0)
         logged_name = "User" if privacy_on else user_name
-        db.add_message(chat_id, "user", user_text, logged_name)
-        db.add_message(chat_id, "assistant", reply)
+        turn = [
+            ("user", user_text, logged_name),
+            ("assistant", reply, None),
+        ]
+        remember_messages(chat_id, turn)
+        # Window is full, so older messages may be piling up: fold them into the summary
+        summarize = len(history) >= MAX_HISTORY and chat_id not in _SUMMARIZING
+        if summarize:
+            _SUMMARIZING.add(chat_id)
+        # The reply doesn't have to wait for the SQLite write
+        _fire_and_forget(persist_turn(chat_id, turn, summarize))
     else:
         reply = "Ahh my brain glitched~ 🥺 try again please! 💖"
 
     return reply
 
+class ReplyStreamer:
+    """Shows a reply while it is generated by editing a single Telegram message."""
+
+    EDIT_INTERVAL = 0.8  # seconds between edits, Telegram allows about one per second
+    MIN_NEW_CHARS = 24   # don't spend an edit on less new text than this
+    CURSOR = " ▌"
+
+    def __init__(self, bot, chat_id, reply_to_message_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.message = None
+        self._latest = ""
+        self._shown_len = 0
+        self._last_edit = 0.0
+        self._pending = None
+        self._closed = False
+
+    def update(self, text):
+        """Record the text generated so far, scheduling an edit when enough is new."""
+        self._latest = text
+        if self._closed or self._pending:
+            return
+        if len(text) - self._shown_len < self.MIN_NEW_CHARS:
+            return
+        if time.monotonic() - self._last_edit < self.EDIT_INTERVAL:
+            return
+        self._pending = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        raw = self._latest
+        try:
+            text = clean_ai_reply(raw)
+            if not text:
+                return
+            if self.message is None:
+                self.message = await self.bot.send_message(
+                    chat_id=self.chat_id,
+                    text=text + self.CURSOR,
+                    reply_to_message_id=self.reply_to_message_id
+                )
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=self.chat_id,
+                    message_id=self.message.message_id,
+                    text=text + self.CURSOR
+                )
+            self._shown_len = len(raw)
+        except Exception as e:
+            logging.warning(f"⚠️ Stream edit failed: {e}")
+        finally:
+            self._last_edit = time.monotonic()
+            self._pending = None
+
+    async def finish(self, text):
+        """Send the final reply, or replace the streamed draft with it."""
+        self._closed = True
+        if self._pending:
+            await self._pending
+        if self.message is None:
+            await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=text,
+                reply_to_message_id=self.reply_to_message_id
+            )
+        else:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self.message.message_id,
+                text=text
+            )
+
+# Messages to Iris that arrive close together in one chat get a single combined reply
+COALESCE_WINDOW = 0.5  # seconds to wait for more messages after the latest one
+COALESCE_MAX = 5       # reply right away once this many are waiting
+_PENDING_REPLIES = {}  # chat_id -> [(user_name, user_text, message_id), ...]
+_COALESCE_TIMERS = {}  # chat_id -> asyncio.TimerHandle
+_REPLYING = set()      # chat_ids with a reply being generated; one at a time per chat
+
+def _schedule_flush(bot, chat_id, chat_type):
+    timer = _COALESCE_TIMERS.pop(chat_id, None)
+    if timer:
+        timer.cancel()
+    if len(_PENDING_REPLIES.get(chat_id, ())) >= COALESCE_MAX:
+        _fire_and_forget(flush_replies(bot, chat_id, chat_type))
+    else:
+        _COALESCE_TIMERS[chat_id] = asyncio.get_running_loop().call_later(
+            COALESCE_WINDOW, lambda: _fire_and_forget(flush_replies(bot, chat_id, chat_type))
+        )
+
+def queue_reply(bot, chat_id, chat_type, user_name, user_text, message_id):
+    """Queue a message for an AI reply, (re)starting the chat's coalescing timer."""
+    _PENDING_REPLIES.setdefault(chat_id, []).append((user_name, user_text, message_id))
+    # While a reply is in progress, messages just pile up; they're flushed once it's done,
+    # so every reply sees the previous turn and turns are stored in order
+    if chat_id not in _REPLYING:
+        _schedule_flush(bot, chat_id, chat_type)
+
+async def flush_replies(bot, chat_id, chat_type):
+    """Answer everything queued for a chat with one AI call, replying to the latest message."""
+    _COALESCE_TIMERS.pop(chat_id, None)
+    if chat_id in _REPLYING:
+        return
+    pending = _PENDING_REPLIES.pop(chat_id, None)
+    if not pending:
+        return
+
+    _REPLYING.add(chat_id)
+    try:
+        user_name, user_text, message_id = pending[-1]
+        if len(pending) > 1:
+            if all(name == user_name for name, _, _ in pending):
+                user_text = "\n".join(text for _, text, _ in pending)
+            else:
+                # Several people talking: tag each line, respecting privacy mode
+                private = db.get_chat_settings(chat_id).get("privacy_mode", 0)
+                user_text = "\n".join(f"[{'User' if private else name}]: {text}" for name, text, _ in pending)
+                user_name = None
+
+        # Get AI response, showing it as it streams in when the provider supports that.
+        # DMs only: every edit counts against a group's ~20 msg/min limit (see the rate limiter),
+        # so streaming there would stall the group's other replies and mod actions
+        streamer = ReplyStreamer(bot, chat_id, message_id)
+        on_partial = streamer.update if chat_type == "private" else None
+        ai_reply = await get_ai_response(chat_id, user_text, user_name, chat_type, on_partial=on_partial)
+        await streamer.finish(ai_reply)
+    except Exception as e:
+        logging.error(f"Error replying in chat {chat_id}: {e}")
+    finally:
+        _REPLYING.discard(chat_id)
+        # Anything that came in meanwhile gets the next reply
+        if _PENDING_REPLIES.get(chat_id):
+            _schedule_flush(bot, chat_id, chat_type)
+
+# Emoji Iris randomly reacts to messages with
+_REACTIONS = ("❤️", "🔥", "😂", "🥺", "👍", "👏", "🎉", "🤩", "🤔", "💀", "👀", "💖", "😭", "🫡")
+
+# Name trigger: whole word only, so "irish" or "tiramisu" don't wake Iris up
+_IRIS_RE = re.compile(r'\biris\b', re.IGNORECASE)
+
+def build_mention_re(bot_username):
+    """One pattern for "@botname" and the Iris name trigger."""
+    if not bot_username:
+        return _IRIS_RE
+    return re.compile(rf'@{re.escape(bot_username)}\b|\biris\b', re.IGNORECASE)
+
+# Who the bot is, filled in once by post_init so handlers don't look it up per message
+BOT_USERNAME = None
+BOT_ID = None
+MENTION_RE = _IRIS_RE
+
+
+# Auto-mod patterns, compiled once instead of on every message
+_CODE_BLOCK_RE = re.compile(r'```[\s\S]*?```')
+_INLINE_CODE_RE = re.compile(r'`[^`]*`')
+_QUOTE_LINE_RE = re.compile(r'^>.*$', re.MULTILINE)
+_EMOJI_RE = re.compile(r'[\U00010000-\U0010ffff]')
+# Telegram invite links and common shorteners, as one alternation
+_INVITE_LINK_RE = re.compile(r't\.me/joinchat|t\.me/\+|telegram\.me/joinchat|bit\.ly|goo\.gl|t\.co')
+# "script:<name>" filters
+_SCRIPT_RES = {
+    "arabic": re.compile(r'[\u0600-\u06FF]'),
+    "cyrillic": re.compile(r'[\u0400-\u04FF]'),
+    "chinese": re.compile(r'[\u4e00-\u9fff]'),
+}
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -2581,7 +3124,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
     # 1. Bot Account Detection (New)
-    if update.effective_user and update.effective_user.is_bot and update.effective_user.id != context.bot.id:
+    if update.effective_user and update.effective_user.is_bot and update.effective_user.id != BOT_ID:
         if chat_type != "private":
             logging.info(f"🤖 Bot detected in group: {user_name} ({user_id})")
             # Auto-ban or warn bot accounts? User said "don't want any bot accounts... analyze then warn... no bot accounts allowed"
@@ -2600,12 +3143,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # --- Context-Aware Pre-processing ---
     # Strip code blocks and quotes for filter checks
-    filtered_text = re.sub(r'```[\s\S]*?```', '', user_text) # Multi-line code
-    filtered_text = re.sub(r'`[^`]*`', '', filtered_text)    # Single-line code
-    filtered_text = re.sub(r'^>.*$', '', filtered_text, flags=re.MULTILINE) # Quotes
+    filtered_text = _CODE_BLOCK_RE.sub('', user_text)        # Multi-line code
+    filtered_text = _INLINE_CODE_RE.sub('', filtered_text)   # Single-line code
+    filtered_text = _QUOTE_LINE_RE.sub('', filtered_text)    # Quotes
     filtered_text = filtered_text.strip()
-    
-    bot_username = context.bot.username
+    filtered_lower = filtered_text.lower()  # for the case-insensitive word checks below
 
     # 2. NSFW & Content Filtering (New)
     settings = db.get_mod_settings(chat_id)
@@ -2649,7 +3191,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         logging.error(f"Caps filter failed: {e}")
 
             # --- Context-Aware: Emoji Spam ---
-            emoji_count = len(re.findall(r'[\U00010000-\U0010ffff]', user_text))
+            emoji_count = len(_EMOJI_RE.findall(user_text))
             if emoji_count > 10:
                 try:
                     await update.message.delete()
@@ -2660,11 +3202,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # --- Link Filtering ---
             # Block telegram invite links and common shorteners if they contain suspicious patterns
-            link_patterns = [
-                r"t\.me/joinchat", r"t\.me/\+", r"telegram\.me/joinchat", 
-                r"bit\.ly", r"goo\.gl", r"t\.co"
-            ]
-            if any(re.search(pattern, user_text) for pattern in link_patterns):
+            if _INVITE_LINK_RE.search(user_text):
                 try:
                     await update.message.delete()
                     await context.bot.send_message(chat_id, f"🚫 No invite links or shorteners allowed, {user_name}! 🥺")
@@ -2674,7 +3212,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # --- NSFW Words (Checked against filtered_text) ---
             nsfw_words = ["nsfw", "porn", "hentai", "sex", "pussy", "dick"] # Very basic list
-            if any(word in filtered_text.lower() for word in nsfw_words):
+            if any(word in filtered_lower for word in nsfw_words):
                 try:
                     await update.message.delete()
                     count = db.add_warn(chat_id, user_id, "NSFW content (Auto-Mod)")
@@ -2697,17 +3235,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
                 match = False
                 if pattern.startswith("script:"):
-                    script = pattern[7:].lower()
-                    if script == "arabic" and re.search(r'[\u0600-\u06FF]', filtered_text): match = True
-                    elif script == "cyrillic" and re.search(r'[\u0400-\u04FF]', filtered_text): match = True
-                    elif script == "chinese" and re.search(r'[\u4e00-\u9fff]', filtered_text): match = True
+                    script_re = _SCRIPT_RES.get(pattern[7:].lower())
+                    if script_re and script_re.search(filtered_text): match = True
                 elif is_regex:
                     try:
                         if re.search(pattern, filtered_text, re.IGNORECASE):
                             match = True
                     except:
                         pass
-                elif pattern.lower() in filtered_text.lower():
+                elif pattern.lower() in filtered_lower:
                     match = True
                 
                 if match:
@@ -2733,110 +3269,44 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Logging
     logging.info(f"Received message from {user_name} in {chat_id}: {user_text}")
     
-    # Normalize triggers
-    mentioned = False
-    if update.message.reply_to_message and update.message.reply_to_message.from_user.id == context.bot.id:
-        mentioned = True
-    elif bot_username and f"@{bot_username}" in user_text:
-        mentioned = True
-    elif "iris" in user_text.lower():
-        mentioned = True 
-
-    # Handle !iris as a reset/start command
-    if user_text.strip().lower() == "!iris":
-        await start(update, context)
-        return
-
-    # Handle !reset
-    if user_text.strip().lower() == "!reset":
-        await reset(update, context)
-        return
-
-    # Handle !donate
-    if user_text.strip().lower() == "!donate":
-        await donate(update, context)
-        return
-
-    # Handle ! prefixed meme commands (since MessageHandler catches these, not CommandHandler)
-    lower_text = user_text.strip().lower()
-    bang_commands = {
-        "!meme": meme_command, "!roast": roast_command, "!ship": ship_command,
-        "!8ball": eightball_command, "!uwu": uwu_command, "!rate": rate_command,
-        "!vibe": vibe_command, "!pp": pp_command, "!howgay": howgay_command,
-        "!simprate": simprate_command, "!truth": game_truth, "!dare": game_dare,
-        "!trivia": game_trivia, "!help": help_command, "!mhelp": mhelp_command,
-        "!balance": economy.balance, "!bal": economy.balance, "!beg": economy.beg,
-        "!daily": economy.daily, "!gamble": economy.gamble, "!bet": economy.gamble,
-        "!pay": economy.pay, "!rich": economy.leaderboard, "!leaderboard": economy.leaderboard,
-        "!warn": warn_command, "!mute": mute_command, "!unmute": unmute_command,
-        "!ban": ban_command, "!unban": unban_command, "!kick": kick_command, "!purge": purge_command,
-        "!filter": filter_command, "!stats": stats_command, "!lock": lock_command, "!unlock": unlock_command,
-        "!privacy": privacy_command, "!export": export_command,
-        "!import": import_command, "!retention": retention_command,
-        "!admincheck": admincheck_command, "!setwarnaction": setwarnaction_command,
-        "!antiflood": antiflood_command, "!pin": pin_command, "!unpin": unpin_command,
-        "!promote": promote_command, "!demote": demote_command, "!announce": announce_command,
-        "!report": report_command, "!rules": rules_command, "!setrules": setrules_command,
-        "!note": note_command, "!notes": notes_command, "!savenote": savenote_command,
-        "!delnote": delnote_command, "!groupstats": groupstats_command, "!qr": qr_command,
-        # New fun commands
-        "!coinflip": coinflip_command, "!flip": coinflip_command,
-        "!wyr": wyr_command, "!wouldyourather": wyr_command,
-        "!compliment": compliment_command, "!quote": quote_command,
-        "!hack": hack_command, "!fight": fight_command,
-        "!marry": marry_command, "!divorce": divorce_command,
-        "!hug": hug_command, "!slap": slap_command, "!pat": pat_command,
-        "!choose": choose_command, "!reverse": reverse_command,
-        # New economy commands
-        "!work": economy.work, "!rob": economy.rob, "!slots": economy.slots,
-        "!shop": economy.shop, "!buy": economy.buy, "!inventory": economy.inventory,
-        "!inv": economy.inventory, "!badges": economy.badges_command,
-        "!use": economy.use_item, "!gift": economy.gift_item, "!profile": economy.profile_command,
-        # New moderation commands
-        "!setwelcome": setwelcome_command, "!setgoodbye": setgoodbye_command,
-        "!slowmode": slowmode_command,
-    }
-    for cmd, handler in bang_commands.items():
-        if lower_text == cmd or lower_text.startswith(cmd + " "):
-            # Parse args for commands that need them
-            parts = user_text.strip().split(maxsplit=1)
-            context.args = parts[1].split() if len(parts) > 1 else []
-            await handler(update, context)
-            return
+    # Normalize triggers: a reply to Iris, or "@botname"/"iris" anywhere in one regex pass
+    reply_to = update.message.reply_to_message
+    mentioned = bool(
+        (reply_to and reply_to.from_user and reply_to.from_user.id == BOT_ID)
+        or MENTION_RE.search(user_text)
+    )
 
-    # Handle !roleplay separately (needs special arg handling)
-    if lower_text.startswith("!roleplay"):
-        parts = user_text.strip().split(maxsplit=1)
+    # Handle ! prefixed commands (since MessageHandler catches these, not CommandHandler):
+    # one dict lookup on the first word, falling back to the trie for "!pay5" style input
+    # (split() already skips surrounding whitespace, no strip() copy needed)
+    parts = user_text.split(maxsplit=1)
+    handler, glued_arg = match_bang_command(parts[0].lower()) if parts else (None, "")
+    if len(parts) == 1 and not handler:
+        handler = EXACT_COMMANDS.get(parts[0].lower())
+    if handler:
+        # Parse args for commands that need them
         context.args = parts[1].split() if len(parts) > 1 else []
-        await roleplay(update, context)
-        return
-    if lower_text == "!normal":
-        await normal(update, context)
+        if glued_arg:
+            context.args.insert(0, glued_arg)
+        await handler(update, context)
         return
 
     should_reply = (chat_type == 'private') or mentioned
 
     # Fun Feature: Randomly react to messages
     # 30% chance in DMs, 15% in groups (to not be annoying)
-    if random.random() < (0.3 if chat_type == 'private' else 0.15):
-        try:
-            reactions = ["❤️", "🔥", "😂", "🥺", "👍", "👏", "🎉", "🤩", "🤔", "💀", "👀", "💖", "😭", "🫡"]
-            await update.message.set_reaction(reaction=random.choice(reactions))
-        except Exception as e:
-            # Reactions might be disabled or not supported in some contexts
-            logging.debug(f"Failed to react: {e}")
+    # Neither the reaction nor the typing indicator needs to hold up the reply
+    if _RNG.random() < (0.3 if chat_type == 'private' else 0.15):
+        _fire_and_forget(update.message.set_reaction(reaction=_REACTIONS[_RNG.randrange(len(_REACTIONS))]))
 
     if should_reply:
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=constants.ChatAction.TYPING)
-        
-        # Get AI response
-        ai_reply = await get_ai_response(update.effective_chat.id, user_text, user_name, chat_type)
+        # A streamed reply (DMs only) shows its own progress, so typing is only sent for the others
+        streams = chat_type == "private" and LLM_CHAIN and LLM_CHAIN[0][0] in STREAMING_PROVIDERS
+        if not streams:
+            _fire_and_forget(context.bot.send_chat_action(chat_id=update.effective_chat.id, action=constants.ChatAction.TYPING))
         
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=ai_reply,
-            reply_to_message_id=update.message.message_id
-        )
+        # Replied to in the background, together with anything else that comes in right after
+        queue_reply(context.bot, chat_id, chat_type, user_name, user_text, update.message.message_id)
 
 # ==================== NEW FUN COMMANDS ====================
 
@@ -2845,7 +3315,7 @@ async def coinflip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
 
-    result = random.choice(["Heads", "Tails"])
+    result = _RNG.choice(["Heads", "Tails"])
     emoji = "🪙" if result == "Heads" else "🔄"
 
     # Optional betting
@@ -2911,7 +3381,7 @@ async def compliment_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         f"Being around {target} is like finding a four-leaf clover every single day~ 🍀💖",
     ]
 
-    await context.bot.send_message(chat_id=chat_id, text=f"💖 {random.choice(compliments)}")
+    await context.bot.send_message(chat_id=chat_id, text=f"💖 {_RNG.choice(compliments)}")
 
 async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Random inspirational/funny quote."""
@@ -2933,7 +3403,7 @@ async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ("The only limit to our realization of tomorrow is our doubts of today.", "Franklin D. Roosevelt"),
         ("Dream big. Start small. Act now.", "Robin Sharma"),
     ]
-    text, author = random.choice(quotes)
+    text, author = _RNG.choice(quotes)
     await context.bot.send_message(chat_id=chat_id, text=f"💬 _{text}_\n\n— **{author}** ✨", parse_mode='Markdown')
 
 async def hack_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2978,7 +3448,7 @@ async def hack_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"most visited site: reddit.com/r/memes 💀",
     ]
 
-    final = f"✅ **Hack complete on {target}!**\n\n📋 **Findings:**\n• {random.choice(findings)}\n• {random.choice(findings)}\n• Password: ••••••• (jk~ 😂)\n\n_This was totally a joke~ 💖_"
+    final = f"✅ **Hack complete on {target}!**\n\n📋 **Findings:**\n• {_RNG.choice(findings)}\n• {_RNG.choice(findings)}\n• Password: ••••••• (jk~ 😂)\n\n_This was totally a joke~ 💖_"
 
     try:
         await context.bot.edit_message_text(chat_id=chat_id, message_id=msg.message_id, text=final, parse_mode='Markdown')
@@ -3029,10 +3499,10 @@ async def fight_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     for _round in range(3):
         # User attacks
-        atk_text, atk_dmg = random.choice(attacks)
+        atk_text, atk_dmg = _RNG.choice(attacks)
         # Target defends sometimes
-        if random.random() < 0.3:
-            def_text, def_block = random.choice(defenses)
+        if _RNG.random() < 0.3:
+            def_text, def_block = _RNG.choice(defenses)
             atk_dmg = max(0, atk_dmg - def_block)
             log += f"{atk_text}\n{def_text} (-{def_block} blocked)\n"
         else:
@@ -3040,9 +3510,9 @@ async def fight_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         target_hp -= atk_dmg
 
         # Counter chance
-        if random.random() < 0.15:
-            counter_dmg = random.randint(10, 30)
-            log += f"{random.choice(counters)} (-{counter_dmg} HP to {user_name})\n"
+        if _RNG.random() < 0.15:
+            counter_dmg = _RNG.randint(10, 30)
+            log += f"{_RNG.choice(counters)} (-{counter_dmg} HP to {user_name})\n"
             user_hp -= counter_dmg
 
         log += "\n"
@@ -3158,7 +3628,7 @@ async def action_command(update: Update, context: ContextTypes.DEFAULT_TYPE, act
     }
 
     data = actions.get(action_type, actions["hug"])
-    await context.bot.send_message(chat_id=chat_id, text=random.choice(data["messages"]), parse_mode='Markdown')
+    await context.bot.send_message(chat_id=chat_id, text=_RNG.choice(data["messages"]), parse_mode='Markdown')
 
 async def hug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await action_command(update, context, "hug")
@@ -3188,7 +3658,7 @@ async def choose_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=chat_id, text="Give me at least 2 options! Separate with `or` or `,`", parse_mode='Markdown')
         return
 
-    choice = random.choice(options)
+    choice = _RNG.choice(options)
     await context.bot.send_message(chat_id=chat_id, text=f"🤔 Hmm... I choose **{choice}**! ✨", parse_mode='Markdown')
 
 async def reverse_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3217,24 +3687,16 @@ async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     text = " ".join(context.args)
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(text)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-
-    bio = io.BytesIO()
-    img.save(bio, 'PNG')
-    bio.seek(0)
+    png = await run_qr(render_qr_png, text)
 
     await context.bot.send_photo(
         chat_id=update.effective_chat.id,
-        photo=bio,
+        photo=io.BytesIO(png),
         caption=f"Here's your QR code~ 💖"
     )
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """User help - General commands for everyone"""
-    help_text = """
+# Help texts are fixed, so they are built once at import
+_HELP_TEXT = """
 ✨ **Iris - Your Cute AI Friend!** ✨
 
 Hii~ here's everything I can do! 💖
@@ -3308,22 +3770,8 @@ Hii~ here's everything I can do! 💖
 
 Have fun~ 🌸💖
 """
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=help_text, parse_mode='Markdown')
 
-async def mhelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Moderation help - Admin commands only"""
-    # Show full help for admins, basic info for users
-    is_user_admin = await is_admin(update, context)
-    
-    if not is_user_admin:
-        await update.message.reply_text(
-            "🛡️ **Moderation Commands** 🛡️\n\n"
-            "These commands are for admins only!\n"
-            "If you're an admin, you'll see the full list when you use this command~ 💕"
-        )
-        return
-    
-    help_text = """
+_MHELP_TEXT = """
 🛡️ **Iris Moderation Guide** 🛡️
 
 **USER MANAGEMENT**
@@ -3437,7 +3885,25 @@ async def mhelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Need help? Tag an owner or check `!help` for user commands! 💕
 """
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=help_text, parse_mode='Markdown')
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """User help - General commands for everyone"""
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=_HELP_TEXT, parse_mode='Markdown')
+
+async def mhelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Moderation help - Admin commands only"""
+    # Show full help for admins, basic info for users
+    is_user_admin = await is_admin(update, context)
+    
+    if not is_user_admin:
+        await update.message.reply_text(
+            "🛡️ **Moderation Commands** 🛡️\n\n"
+            "These commands are for admins only!\n"
+            "If you're an admin, you'll see the full list when you use this command~ 💕"
+        )
+        return
+    
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=_MHELP_TEXT, parse_mode='Markdown')
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Global error handler to log unhandled exceptions."""
@@ -3457,7 +3923,7 @@ async def init_telethon():
     
     if TELEGRAM_API_ID and TELEGRAM_API_HASH:
         try:
-            telethon_client = TelegramClient('iris_session', int(TELEGRAM_API_ID), TELEGRAM_API_HASH)
+            telethon_client = TelegramClient('iris_session', TELEGRAM_API_ID, TELEGRAM_API_HASH)
             await telethon_client.start()
             print("✅ Telethon client initialized for advanced username lookups!")
         except Exception as e:
@@ -3465,11 +3931,170 @@ async def init_telethon():
             logging.warning("Username lookups will fall back to bot API only.")
             telethon_client = None
     else:
-        logging.info("ℹ️ Telethon credentials not provided. Username lookups will use bot API only.")
+        logging.info("ℹ️ Telethon credentials not provided (or TELEGRAM_API_ID isn't a number). Username lookups will use bot API only.")
+
+# "!command" text triggers, looked up by the message's first word in handle_message.
+# Defined down here because it needs every handler above.
+BANG_COMMANDS = {
+    "!roleplay": roleplay,
+    "!meme": meme_command, "!roast": roast_command, "!ship": ship_command,
+    "!8ball": eightball_command, "!uwu": uwu_command, "!rate": rate_command,
+    "!vibe": vibe_command, "!pp": pp_command, "!howgay": howgay_command,
+    "!simprate": simprate_command, "!truth": game_truth, "!dare": game_dare,
+    "!trivia": game_trivia, "!help": help_command, "!mhelp": mhelp_command,
+    "!balance": economy.balance, "!bal": economy.balance, "!beg": economy.beg,
+    "!daily": economy.daily, "!gamble": economy.gamble, "!bet": economy.gamble,
+    "!pay": economy.pay, "!rich": economy.leaderboard, "!leaderboard": economy.leaderboard,
+    "!warn": warn_command, "!mute": mute_command, "!unmute": unmute_command,
+    "!ban": ban_command, "!unban": unban_command, "!kick": kick_command, "!purge": purge_command,
+    "!filter": filter_command, "!stats": stats_command, "!lock": lock_command, "!unlock": unlock_command,
+    "!privacy": privacy_command, "!export": export_command,
+    "!import": import_command, "!retention": retention_command,
+    "!admincheck": admincheck_command, "!setwarnaction": setwarnaction_command,
+    "!antiflood": antiflood_command, "!pin": pin_command, "!unpin": unpin_command,
+    "!promote": promote_command, "!demote": demote_command, "!announce": announce_command,
+    "!report": report_command, "!rules": rules_command, "!setrules": setrules_command,
+    "!note": note_command, "!notes": notes_command, "!savenote": savenote_command,
+    "!delnote": delnote_command, "!groupstats": groupstats_command, "!qr": qr_command,
+    # New fun commands
+    "!coinflip": coinflip_command, "!flip": coinflip_command,
+    "!wyr": wyr_command, "!wouldyourather": wyr_command,
+    "!compliment": compliment_command, "!quote": quote_command,
+    "!hack": hack_command, "!fight": fight_command,
+    "!marry": marry_command, "!divorce": divorce_command,
+    "!hug": hug_command, "!slap": slap_command, "!pat": pat_command,
+    "!choose": choose_command, "!reverse": reverse_command,
+    # New economy commands
+    "!work": economy.work, "!rob": economy.rob, "!slots": economy.slots,
+    "!shop": economy.shop, "!buy": economy.buy, "!inventory": economy.inventory,
+    "!inv": economy.inventory, "!badges": economy.badges_command,
+    "!use": economy.use_item, "!gift": economy.gift_item, "!profile": economy.profile_command,
+    # New moderation commands
+    "!setwelcome": setwelcome_command, "!setgoodbye": setgoodbye_command,
+    "!slowmode": slowmode_command,
+}
+
+# Character trie over the command names (nested dicts, the handler stored under None),
+# used when the first word isn't an exact command, e.g. an amount glued on like "!pay5"
+# Commands that only match the whole message (no args). With anything after them the
+# message falls through to the normal chat path, so "!iris tell me a joke" still gets an AI reply
+EXACT_COMMANDS = {
+    "!iris": start,  # !iris works as a start/wake-up command
+    "!reset": reset,
+    "!donate": donate,
+    "!normal": normal,
+}
+
+def build_command_trie(commands):
+    root = {}
+    for name, handler in commands.items():
+        node = root
+        for ch in name:
+            node = node.setdefault(ch, {})
+        node[None] = handler
+    return root
+
+BANG_TRIE = build_command_trie(BANG_COMMANDS)
+
+def match_bang_command(word):
+    """Return (handler, glued_arg) for a lowercased first word, or (None, "")."""
+    handler = BANG_COMMANDS.get(word)
+    if handler or not word.startswith("!"):
+        return handler, ""
+    # Longest command the word starts with, as long as what follows it is a number
+    node, match = BANG_TRIE, (None, "")
+    for i, ch in enumerate(word):
+        node = node.get(ch)
+        if node is None:
+            break
+        if None in node and word[i + 1:i + 2].isdigit():
+            match = (node[None], word[i + 1:])
+    return match
+
+async def post_init(application):
+    """Runs once after the bot is initialized, before polling starts."""
+    global HTTP_CLIENT, BOT_USERNAME, BOT_ID, MENTION_RE
+    _RNG.seed(os.urandom(32))
+
+    # Remaining blocking work (asyncio.to_thread, DNS lookups) uses the default executor.
+    # Size it for I/O instead of the stock min(32, cpu_count + 4).
+    default_pool = (os.cpu_count() or 1) * 5
+    try:
+        pool_size = int(os.getenv("IRIS_THREAD_POOL", default_pool))
+        if pool_size <= 0:
+            raise ValueError("must be positive")
+    except ValueError:
+        logging.warning(f"⚠️ Invalid IRIS_THREAD_POOL {os.getenv('IRIS_THREAD_POOL')!r}, using {default_pool}")
+        pool_size = default_pool
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="iris")
+    )
+    me = await application.bot.get_me()
+    BOT_USERNAME, BOT_ID = me.username, me.id
+    MENTION_RE = build_mention_re(me.username)
+
+    HTTP_CLIENT = create_http_client()
+
+    # Probe Ollama and Groq at the same time, then put whichever answered at the
+    # front of the chain in priority order (Ollama, then Groq)
+    priority = ("ollama", "groq")
+    results = await asyncio.gather(resolve_ollama(), resolve_groq(), return_exceptions=True)
+    for name, result in zip(priority, results):
+        if isinstance(result, Exception):
+            logging.error(f"❌ {name} startup check crashed: {result}")
+    ENABLED_PROVIDERS[:0] = [name for name, result in zip(priority, results) if result is True]
+    LLM_CHAIN[:] = [(name, _PROVIDER_FUNCS[name]) for name in ENABLED_PROVIDERS]
+
+    if not ENABLED_PROVIDERS:
+        logging.warning("❌ No AI providers available! Bot will be brainless.")
+    else:
+        logging.info(f"🚀 Active AI Providers (in order): {', '.join(ENABLED_PROVIDERS)}")
+
+    # Pay the one-off startup costs now instead of on the first user request
+    if "ollama" in ENABLED_PROVIDERS:
+        _fire_and_forget(warm_ollama_model())
+    if donation_configured():
+        _fire_and_forget(run_qr(donate_qr_png, UPI_ID))
+
+class SendRateLimiter(BaseRateLimiter):
+    """AIORateLimiter for the calls that post or edit messages only.
+
+    Telegram's per-group limit is about messages, but AIORateLimiter would also queue
+    admin lookups, deletes, restricts, reactions and chat actions behind it, and since
+    updates are handled one at a time a single busy group would stall every other chat.
+    """
+
+    def __init__(self, **kwargs):
+        self._limiter = AIORateLimiter(**kwargs)
+
+    @staticmethod
+    def _is_send(endpoint):
+        return endpoint.startswith(("send", "editMessage", "copyMessage", "forwardMessage")) and endpoint != "sendChatAction"
+
+    async def initialize(self):
+        await self._limiter.initialize()
+
+    async def shutdown(self):
+        await self._limiter.shutdown()
+
+    async def process_request(self, callback, args, endpoint, data, rate_limit_args):
+        if self._is_send(endpoint):
+            return await self._limiter.process_request(callback, args, endpoint, data, rate_limit_args)
+        return await callback(*args)
+
+async def post_shutdown(application):
+    """Close the shared HTTP client when the bot stops (the Groq clients use it too)."""
+    if HTTP_CLIENT:
+        await HTTP_CLIENT.aclose()
+    # Let queued history writes finish; pending QR renders can just be dropped
+    db.WRITER.shutdown(wait=True)
+    QR_POOL.shutdown(wait=False, cancel_futures=True)
+    ai_cache.close_cache()
 
 if __name__ == '__main__':
     # Initialize Database
     db.init_db()
+    ai_cache.init_cache()
 
     if not TELEGRAM_TOKEN:
         print("Error: TELEGRAM_BOT_TOKEN not found in .env file.")
@@ -3482,9 +4107,29 @@ if __name__ == '__main__':
         asyncio.set_event_loop(loop)
         loop.run_until_complete(init_telethon())
         
-        # Increase connection timeouts to handle slow networks/server lag
-        request = HTTPXRequest(connect_timeout=30.0, read_timeout=30.0)
-        application = ApplicationBuilder().token(TELEGRAM_TOKEN).request(request).build()
+        # Increase connection timeouts to handle slow networks/server lag.
+        # A big pool so reactions, typing and replies don't queue behind each other,
+        # and polling gets its own request object so it never starves outgoing sends.
+        request = HTTPXRequest(
+            connection_pool_size=256,
+            pool_timeout=5.0,
+            connect_timeout=30.0,
+            read_timeout=30.0,
+        )
+        updates_request = HTTPXRequest(connect_timeout=30.0, read_timeout=30.0)
+        application = (
+            ApplicationBuilder()
+            .token(TELEGRAM_TOKEN)
+            .request(request)
+            .get_updates_request(updates_request)
+            .rate_limiter(SendRateLimiter(
+                overall_max_rate=25, overall_time_period=1,  # stay under Telegram's ~30 msg/s bot-wide limit
+                group_max_rate=18, group_time_period=60,     # and the ~20 msg/min per-group limit
+            ))
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         
         start_handler = CommandHandler('start', start)
         msg_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message)
@@ -3596,6 +4241,7 @@ if __name__ == '__main__':
         # Schedule periodic cleanup (every 24 hours) if JobQueue is available
         if application.job_queue:
             application.job_queue.run_repeating(cleanup_job, interval=86400, first=10)
+            application.job_queue.run_repeating(sweep_state_job, interval=600, first=600)
         else:
             logging.warning("⚠️ JobQueue not available. Scheduled tasks (like log cleanup) will not run.")
 